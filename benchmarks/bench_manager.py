@@ -0,0 +1,222 @@
+###############################################################################
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+
+'''Measures `SaltRESTManager.call' against a local fake Salt API.
+
+For every combination of concurrency, payload size and codec, runs
+a number of `state.highstate' (or any other function's) calls and
+reports the throughput, latency percentiles and memory growth.
+
+Every scenario runs in a process of its own, and the fake API in yet
+another one, so the peak memory of one scenario (or of the server)
+does not hide the growth of the next one.
+
+Example:
+    python benchmarks/bench_manager.py --concurrency 1,4,16 \\
+            --states 10,1000 --calls 200 --latency 0.005
+'''
+
+
+import argparse
+import contextlib
+import multiprocessing
+import multiprocessing.pool
+import os
+import resource
+import sys
+import time
+import traceback
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+
+from main import saltapimgr
+
+import fake_salt_api
+
+
+_AUTH_DATA = {'eauth': 'pam', 'username': 'bench', 'password': 'bench'}
+_PERCENTILES = (50, 90, 99)
+_START_TIMEOUT = 10
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def _percentile(ordered, percent):
+    if not ordered:
+        return 0.0
+    index = int(round(percent / 100.0 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def _max_rss_kb():
+    # Kilobytes on Linux; the peak of the whole process' lifetime.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _serve(options, urls, stop):
+    api = fake_salt_api.FakeSaltAPI(**options).start()
+    try:
+        urls.put(api.url)
+        stop.wait()
+    finally:
+        api.stop()
+
+
+@contextlib.contextmanager
+def _fake_api(**options):
+    # Runs the fake API in a process of its own. -> its URL
+    urls = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    process = multiprocessing.Process(
+            target = _serve, args = (options, urls, stop))
+    process.daemon = True
+    process.start()
+    try:
+        yield urls.get(timeout = _START_TIMEOUT)
+    finally:
+        stop.set()
+        process.join()
+
+
+def _report(results, args):
+    try:
+        results.put((run_scenario(*args), None))
+    except Exception:
+        results.put((None, traceback.format_exc()))
+
+
+def run_isolated_scenario(*args):
+    '''Runs a single scenario in a new process. -> dict
+
+    See `run_scenario' for the arguments.
+    '''
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target = _report, args = (results, args))
+    process.start()
+    try:
+        stats, error = results.get()
+    finally:
+        process.join()
+    if error is not None:
+        raise RuntimeError('Scenario failed:\n{0}'.format(error))
+    return stats
+
+
+def run_scenario(api_url, concurrency, calls, function, codec):
+    '''Runs a single scenario. -> dict'''
+    mgr = saltapimgr.SaltRESTManager(
+            api_url,
+            auth_data = _AUTH_DATA,
+            pool_size = concurrency,
+            codec = codec
+        )
+    mgr.log_in()
+    command = {'tgt': '*', 'fun': function}
+
+    def timed_call(_):
+        started = time.time()
+        resp, result = mgr.call(command)
+        if resp is not None and not resp.ok:
+            raise RuntimeError('Call failed: {0}'.format(resp.status_code))
+        return time.time() - started
+
+    pool = multiprocessing.pool.ThreadPool(concurrency)
+    rss_before = _max_rss_kb()
+    started = time.time()
+    try:
+        latencies = sorted(pool.map(timed_call, xrange(calls)))
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - started
+    rss_after = _max_rss_kb()
+    mgr.log_out()
+    stats = {
+            'calls': calls,
+            'seconds': elapsed,
+            'calls_per_second': calls / elapsed if elapsed else 0.0,
+            'max_rss_kb': rss_after,
+            'rss_growth_kb': rss_after - rss_before
+        }
+    for p in _PERCENTILES:
+        stats['p{0}_ms'.format(p)] = _percentile(latencies, p) * 1000
+    return stats
+
+
+def _row(values):
+    return '  '.join(str(v).rjust(10) for v in values)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[0])
+    parser.add_argument(
+            '--concurrency', type = _int_list, default = [1, 4, 16],
+            help = 'comma separated numbers of concurrent callers')
+    parser.add_argument(
+            '--states', type = _int_list, default = [10, 1000],
+            help = 'comma separated numbers of states per result')
+    parser.add_argument(
+            '--state-size', type = int, default = 100,
+            help = 'the size of a single state comment')
+    parser.add_argument(
+            '--minions', type = int, default = 1,
+            help = 'the number of minions responding')
+    parser.add_argument(
+            '--calls', type = int, default = 100,
+            help = 'calls per scenario')
+    parser.add_argument(
+            '--latency', type = float, default = 0,
+            help = 'seconds the fake API adds to every response')
+    parser.add_argument(
+            '--codecs', default = 'yaml,json',
+            help = 'comma separated codecs to compare')
+    parser.add_argument(
+            '--function', default = 'state.highstate',
+            help = 'the Salt function to call')
+    args = parser.parse_args(argv)
+
+    minions = ['minion{0}'.format(i) for i in xrange(args.minions)]
+    columns = ['codec', 'states', 'callers', 'calls/s'] + [
+            'p{0} ms'.format(p) for p in _PERCENTILES] + ['rss+ KB']
+    print _row(columns)
+    for states in args.states:
+        with _fake_api(
+                minions = minions,
+                latency = args.latency,
+                state_count = states,
+                state_size = args.state_size) as api_url:
+            for codec in args.codecs.split(','):
+                for concurrency in args.concurrency:
+                    stats = run_isolated_scenario(
+                            api_url,
+                            concurrency,
+                            args.calls,
+                            args.function,
+                            codec
+                        )
+                    print _row(
+                            [codec, states, concurrency,
+                                round(stats['calls_per_second'], 1)] +
+                            [round(stats['p{0}_ms'.format(p)], 2)
+                                for p in _PERCENTILES] +
+                            [stats['rss_growth_kb']]
+                        )
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,7 @@
 
 
 import os
+import requests
 import subprocess
 
 from cloudify import ctx
@@ -21,20 +22,24 @@ from cloudify.decorators import operation
 from cloudify.exceptions import NonRecoverableError
 from cloudify.exceptions import RecoverableError
 
+import package_cache
 from validation import validate_context
 
 
 _DEFAULT_INSTALLATION_SCRIPT_PATH = 'utility/default_minion_installation.sh'
+_PACKAGES_VARIABLE = 'SALT_MINION_PACKAGES'
 
 
 def _install_minion():
     command = _get_installation_script()
+    env = _get_installation_environment()
     ctx.logger.info('Installing Salt minion using {0}'.format(command))
     try:
         output = subprocess.check_output(
             command,
             stderr=subprocess.STDOUT,
-            shell=True
+            shell=True,
+            env=env
         )
     except subprocess.CalledProcessError as e:
         ctx.logger.error(_format_output(command, e.output))
@@ -55,6 +60,34 @@ def _get_installation_script():
     return command
 
 
+def _get_installation_environment():
+    # Pinned packages are passed to the installation script as a space
+    # separated list of paths.
+    packages = ctx.node.properties.get('minion_packages', None)
+    if not packages:
+        return None
+    cache_dir = packages.get('cache_dir', package_cache.DEFAULT_CACHE_DIR)
+    try:
+        paths, hits = package_cache.get_all(
+            cache_dir,
+            packages.get('source', None),
+            packages['packages']
+        )
+    except package_cache.ChecksumMismatch as e:
+        raise NonRecoverableError(str(e))
+    except (IOError, OSError, requests.exceptions.RequestException) as e:
+        raise RecoverableError(
+            'Unable to fetch Salt minion packages: {0}'.format(e)
+        )
+    ctx.logger.info(
+        'Using {0} pinned packages ({1} cached in {2}).'.format(
+            len(paths), hits, cache_dir)
+    )
+    env = dict(os.environ)
+    env[_PACKAGES_VARIABLE] = ' '.join(paths)
+    return env
+
+
 def _get_default_installation_script():
     ctx.logger.debug('Installation script not provided, using default.')
     return os.path.join(
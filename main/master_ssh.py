@@ -0,0 +1,179 @@
+###############################################################################
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+
+'''Commands run on the Salt master over a shared SSH connection.
+
+The first command opens a multiplexed master connection (OpenSSH's
+ControlMaster), which is then kept open in the background for
+`control_persist' seconds after its last use. Further commands, run by
+any operation (or process) on the same agent host, are sent through it
+without another handshake.
+'''
+
+
+import contextlib
+import errno
+import fcntl
+import hashlib
+import os
+import stat
+import subprocess
+import threading
+
+
+DEFAULT_CONTROL_PERSIST = 600
+
+_CONNECT_TIMEOUT = 10
+
+# Private to the agent user: other local users must not be able to plant
+# sockets or lock files in it.
+_CONTROL_DIR = os.path.join('~', '.ssh', 'cloudify-salt')
+# Serialises opening master connections within a process; a lock file
+# does so between processes.
+_lock = threading.Lock()
+
+
+def _ssh_options(key_file):
+    return [
+        '-i', key_file,
+        '-oStrictHostKeyChecking=no',
+        '-oUserKnownHostsFile=/dev/null',
+        # Never prompt (e.g. for a passphrase) nor hang on an unreachable
+        # master, as others may be waiting for the lock.
+        '-oBatchMode=yes',
+        '-oConnectTimeout={0}'.format(_CONNECT_TIMEOUT)
+    ]
+
+
+def _control_dir():
+    # -> the control directory, created if needed
+    # Raises OSError unless it is owned by the current user and
+    # accessible by nobody else.
+    control_dir = os.path.expanduser(_CONTROL_DIR)
+    try:
+        os.makedirs(control_dir, 0700)
+    except OSError:
+        if not os.path.isdir(control_dir):
+            raise
+    info = os.lstat(control_dir)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid()
+            or stat.S_IMODE(info.st_mode) & 0077):
+        raise OSError(
+            errno.EPERM,
+            'Refusing to use an insecure control directory',
+            control_dir
+        )
+    return control_dir
+
+
+def _control_path(control_dir, target, key_file):
+    # Socket paths are limited to about a hundred characters.
+    digest = hashlib.sha1('{0}\0{1}'.format(target, key_file)).hexdigest()
+    return os.path.join(control_dir, digest[:16])
+
+
+@contextlib.contextmanager
+def _locked(path):
+    with _lock:
+        fd = os.open(
+            path + '.lock',
+            os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW,
+            0600
+        )
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+
+def _run_quietly(command):
+    with open(os.devnull, 'r+') as devnull:
+        return subprocess.call(
+            command,
+            stdin=devnull,
+            stdout=devnull,
+            stderr=devnull
+        )
+
+
+def _master_alive(target, control_path):
+    if not os.path.exists(control_path):
+        return False
+    return _run_quietly(
+        ['ssh', '-oControlPath=' + control_path, '-O', 'check', target]
+    ) == 0
+
+
+def _open_master(target, key_file, control_path, control_persist):
+    # -> if a master connection is open (possibly opened by someone else)
+    if _master_alive(target, control_path):
+        return True
+    with _locked(control_path):
+        if _master_alive(target, control_path):
+            return True
+        # Left behind by a killed master; ssh would otherwise disable
+        # multiplexing and stay in the background as a plain connection.
+        if os.path.lexists(control_path):
+            os.remove(control_path)
+        # Forks into the background once authenticated.
+        _run_quietly(
+            ['ssh'] + _ssh_options(key_file) + [
+                '-oControlMaster=yes',
+                '-oControlPath=' + control_path,
+                '-oControlPersist={0}'.format(control_persist),
+                '-f', '-N',
+                target
+            ]
+        )
+        return _master_alive(target, control_path)
+
+
+def command(user, host, key_file, remote_command,
+            control_persist=DEFAULT_CONTROL_PERSIST):
+    '''Returns the `ssh' command line running a command on the master.
+    -> list
+
+    Unless `control_persist' is 0, a master connection is opened first
+    (if there is none yet) and the command is sent through it. Should
+    that fail, the command line opens a connection of its own.
+
+    Arguments:
+        * user, host = the user to log in as and the master's address,
+        * key_file = path to the private key,
+        * remote_command = the command to be run,
+        * control_persist = the number of seconds an idle master
+                connection is kept open for.
+    '''
+    target = '{0}@{1}'.format(user, host)
+    options = _ssh_options(key_file)
+    if control_persist:
+        try:
+            control_path = _control_path(_control_dir(), target, key_file)
+            multiplexed = _open_master(
+                target, key_file, control_path, control_persist)
+        except (IOError, OSError):
+            multiplexed = False
+        if multiplexed:
+            # Falls back to a connection of its own if the master
+            # connection has gone away in the meantime.
+            options += [
+                '-oControlMaster=no',
+                '-oControlPath=' + control_path
+            ]
+    return ['ssh'] + options + [target, remote_command]
@@ -0,0 +1,192 @@
+###############################################################################
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+
+'''Checks whether the local minion is connected to its master, without
+asking the master.
+
+A minion is ready once:
+    * process - its process (named by its pid file) is running,
+    * authentication - it has authenticated with the master (and cached
+            the master's public key),
+    * connection - it holds an established TCP connection to the master's
+            publish port (on any of the master's addresses).
+
+Conditions which cannot be checked (e.g. the PKI directory is not
+readable by the agent, there is no `/proc' or the master's name does
+not resolve) are assumed to be met.
+'''
+
+
+import errno
+import os
+import socket
+import struct
+import time
+
+
+DEFAULT_MASTER = 'salt'
+DEFAULT_PID_FILE = '/var/run/salt-minion.pid'
+DEFAULT_PKI_DIR = '/etc/salt/pki/minion'
+DEFAULT_PUBLISH_PORT = 4505
+DEFAULT_TIMEOUT = 30
+
+PROCESS = 'process'
+AUTHENTICATION = 'authentication'
+CONNECTION = 'connection'
+
+_POLL_INTERVAL = 0.25
+_MASTER_KEY = 'minion_master.pub'
+_TCP_TABLES = ('/proc/net/tcp', '/proc/net/tcp6')
+_ESTABLISHED = '01'
+_IPV4_MAPPED_PREFIX = '\0' * 10 + '\xff\xff'
+
+
+def _process_running(pid_file):
+    try:
+        with open(pid_file) as f:
+            pid = int(f.read().strip())
+    except (IOError, OSError) as e:
+        if e.errno in (errno.EACCES, errno.EPERM):
+            # Not readable by the agent.
+            return None
+        return False
+    except ValueError:
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # Running as another user.
+        return e.errno == errno.EPERM
+    return True
+
+
+def _authenticated(pki_dir):
+    if not os.access(pki_dir, os.X_OK):
+        return None
+    return os.path.exists(os.path.join(pki_dir, _MASTER_KEY))
+
+
+def _unmapped(packed):
+    # IPv4-mapped IPv6 addresses (`::ffff:a.b.c.d') are IPv4 ones.
+    if packed.startswith(_IPV4_MAPPED_PREFIX):
+        return packed[len(_IPV4_MAPPED_PREFIX):]
+    return packed
+
+
+def _master_addresses(master, port):
+    # -> packed addresses of the master(s), None if none resolves
+    if isinstance(master, basestring):
+        master = [master]
+    addresses = set()
+    for host in master:
+        try:
+            infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        except socket.error:
+            continue
+        for family, _, _, _, address in infos:
+            # Drops the scope of link-local IPv6 addresses.
+            host_address = address[0].split('%', 1)[0]
+            addresses.add(_unmapped(socket.inet_pton(family, host_address)))
+    return addresses or None
+
+
+def _table_address(hex_address):
+    # -> the packed address; tables print it as 32-bit words in host
+    # byte order.
+    return _unmapped(''.join(
+        struct.pack('=I', int(hex_address[i:i + 8], 16))
+        for i in xrange(0, len(hex_address), 8)
+    ))
+
+
+def _connected(port, masters):
+    # Table rows: `sl local_address rem_address st ...', addresses
+    # being `<hex address>:<hex port>'.
+    if masters is None:
+        return None
+    checked = False
+    for table in _TCP_TABLES:
+        try:
+            with open(table) as f:
+                lines = f.readlines()[1:]
+        except (IOError, OSError):
+            continue
+        checked = True
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 4 or fields[3] != _ESTABLISHED:
+                continue
+            address, remote_port = fields[2].rsplit(':', 1)
+            if (int(remote_port, 16) == port
+                    and _table_address(address) in masters):
+                return True
+    if not checked:
+        return None
+    return False
+
+
+def _settings(minion_config):
+    # -> (pid file, PKI directory, publish port, master addresses)
+    minion_config = minion_config or {}
+    port = int(minion_config.get('publish_port', DEFAULT_PUBLISH_PORT))
+    return (
+        minion_config.get('pidfile', DEFAULT_PID_FILE),
+        minion_config.get('pki_dir', DEFAULT_PKI_DIR),
+        port,
+        _master_addresses(minion_config.get('master', DEFAULT_MASTER), port)
+    )
+
+
+def _unmet(pid_file, pki_dir, port, masters):
+    unmet = []
+    if _process_running(pid_file) is False:
+        unmet.append(PROCESS)
+    if _authenticated(pki_dir) is False:
+        unmet.append(AUTHENTICATION)
+    if _connected(port, masters) is False:
+        unmet.append(CONNECTION)
+    return unmet
+
+
+def unmet_conditions(minion_config=None):
+    '''Returns the conditions the minion does not meet yet. -> list
+
+    Arguments:
+        * minion_config = the minion's configuration overrides (its
+                `master', `pidfile', `pki_dir' and `publish_port' are
+                used).
+    '''
+    return _unmet(*_settings(minion_config))
+
+
+def wait_until_ready(minion_config=None, timeout=DEFAULT_TIMEOUT):
+    '''Waits until the minion is ready. -> list
+
+    Returns the conditions still unmet once `timeout' seconds have
+    passed (an empty list as soon as the minion is ready).
+
+    Arguments:
+        * minion_config = see `unmet_conditions',
+        * timeout = the maximum number of seconds to wait.
+    '''
+    deadline = time.time() + timeout
+    # The master's name is resolved once.
+    settings = _settings(minion_config)
+    while True:
+        unmet = _unmet(*settings)
+        remaining = deadline - time.time()
+        if not unmet or remaining <= 0:
+            return unmet
+        time.sleep(min(_POLL_INTERVAL, remaining))
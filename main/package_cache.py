@@ -0,0 +1,156 @@
+###############################################################################
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+
+'''A content-addressed cache of minion packages.
+
+A package is stored under its SHA-256 checksum
+(`<cache dir>/<first two digits>/<checksum>/<file name>'), so pinned
+packages are fetched once per host and a cached file can be trusted
+as long as its checksum matches. Packages missing from the cache are
+copied from a directory (e.g. a shared mount) or downloaded from
+a mirror (`<source URL>/<file name>').
+'''
+
+
+import hashlib
+import os
+import tempfile
+
+import requests
+
+
+DEFAULT_CACHE_DIR = os.path.join('~', '.cache', 'cloudify-salt', 'packages')
+
+_CHUNK_SIZE = 64 * 1024
+_DOWNLOAD_TIMEOUT = 60
+
+
+class ChecksumMismatch(Exception):
+
+    def __init__(self, name, expected, actual):
+        super(ChecksumMismatch, self).__init__(
+            'Package {0} has checksum {1}, expected {2}.'.format(
+                name, actual, expected)
+        )
+
+
+def _checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _copy_chunks(chunks, f):
+    # -> the checksum of the copied data
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+        f.write(chunk)
+    return digest.hexdigest()
+
+
+def _fetch(source, name, f):
+    # Writes the package to `f'. -> its checksum
+    if source.startswith(('http://', 'https://')):
+        response = requests.get(
+            '{0}/{1}'.format(source.rstrip('/'), name),
+            stream=True,
+            timeout=_DOWNLOAD_TIMEOUT
+        )
+        try:
+            response.raise_for_status()
+            return _copy_chunks(response.iter_content(_CHUNK_SIZE), f)
+        finally:
+            response.close()
+    with open(os.path.join(source, name), 'rb') as package:
+        return _copy_chunks(iter(lambda: package.read(_CHUNK_SIZE), ''), f)
+
+
+def cached_path(cache_dir, name, sha256):
+    '''Returns the path of a package in the cache. -> str'''
+    sha256 = sha256.lower()
+    return os.path.join(
+        os.path.abspath(os.path.expanduser(cache_dir)),
+        sha256[:2],
+        sha256,
+        name
+    )
+
+
+def get(cache_dir, source, name, sha256):
+    '''Returns the path of a verified package, fetching it first if it
+    is not cached. -> (str, bool)
+
+    The second value tells if the package has been taken from the cache.
+    Raises `ChecksumMismatch' if the fetched package does not match
+    (nothing is cached then).
+
+    Arguments:
+        * cache_dir = the cache directory,
+        * source = a directory or a mirror URL the package can be taken
+                from (None if it has to be cached already),
+        * name = the package's file name,
+        * sha256 = the package's SHA-256 checksum.
+    '''
+    path = cached_path(cache_dir, name, sha256)
+    if os.path.isfile(path):
+        if _checksum(path) == sha256.lower():
+            return path, True
+        # Corrupted, e.g. by a full disk.
+        os.remove(path)
+    if not source:
+        raise IOError('Package {0} is not cached.'.format(name))
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    # Concurrent installations may fetch the same package; each writes
+    # a file of its own, which then atomically replaces the cached one.
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix='.' + name)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            actual = _fetch(source, name, f)
+        if actual != sha256.lower():
+            raise ChecksumMismatch(name, sha256.lower(), actual)
+        os.chmod(temporary, 0644)
+        os.rename(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return path, False
+
+
+def get_all(cache_dir, source, packages):
+    '''Returns paths of all the given packages, fetching the ones which
+    are not cached. -> (list, int)
+
+    The second value is the number of packages taken from the cache.
+
+    Arguments:
+        * cache_dir, source = see `get',
+        * packages = a list of dictionaries with `name' and `sha256'.
+    '''
+    paths = []
+    hits = 0
+    for package in packages:
+        path, hit = get(cache_dir, source, package['name'], package['sha256'])
+        paths.append(path)
+        hits += int(hit)
+    return paths, hits
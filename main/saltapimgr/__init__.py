@@ -1 +1,13 @@
 from manager import SaltRESTManager
+from asynchronous import AsyncSaltRESTManager
+import cache
+import coalesce
+import endpoints
+import exceptions
+import log
+import metrics
+import retry
+import sessions
+import templates
+import utils
+from tokencache import TokenCache
@@ -0,0 +1,106 @@
+###############################################################################
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+
+import multiprocessing.pool
+
+import manager
+
+
+DEFAULT_CONNECTION_LIMIT = 10
+
+
+class AsyncSaltRESTManager(object):
+    '''Salt's REST API manager with a non-blocking interface.
+
+    Every method submits the corresponding `SaltRESTManager' method
+    to a pool of at most `connection_limit' workers, each of them
+    borrowing a pooled session, and immediately returns an `AsyncResult'
+    (see `multiprocessing.pool'). Use its `get' method to wait for
+    the (requests.Response, result) pair, or pass a `callback'.
+
+    This is not an event loop: every call in flight occupies a worker
+    thread (and a connection) until it returns, so `connection_limit'
+    concurrent calls cost as many threads, and further calls wait in
+    the queue.
+
+    Interesting methods:
+        * __init__ - constructor,
+        * log_in, log_out, call, ping, highstate, append_grain,
+          list_grains - see `SaltRESTManager',
+        * close - waits for all pending calls and stops the workers.
+
+    Interesting properties:
+        * manager - the underlying synchronous manager.
+    '''
+
+    def __init__(
+            self,
+            api_url,
+            connection_limit = DEFAULT_CONNECTION_LIMIT,
+            **kwargs):
+        '''Manager constructor. -> AsyncSaltRESTManager
+
+        Arguments:
+            * api_url = a mandatory URL to Salt REST API,
+            * connection_limit = the maximum number of calls in flight
+                    (and of worker threads and connections to the API),
+            * kwargs = any other `SaltRESTManager' constructor arguments.
+        '''
+        kwargs.setdefault('pool_size', connection_limit)
+        kwargs.setdefault('thread_safe', True)
+        self.manager = manager.SaltRESTManager(api_url, **kwargs)
+        self._pool = multiprocessing.pool.ThreadPool(connection_limit)
+
+    def _submit(self, method, args, kwargs, callback):
+        return self._pool.apply_async(
+                getattr(self.manager, method),
+                args,
+                kwargs,
+                callback
+            )
+
+    def log_in(self, *args, **kwargs):
+        callback = kwargs.pop('callback', None)
+        return self._submit('log_in', args, kwargs, callback)
+
+    def log_out(self, *args, **kwargs):
+        callback = kwargs.pop('callback', None)
+        return self._submit('log_out', args, kwargs, callback)
+
+    def call(self, *args, **kwargs):
+        callback = kwargs.pop('callback', None)
+        return self._submit('call', args, kwargs, callback)
+
+    def ping(self, *args, **kwargs):
+        callback = kwargs.pop('callback', None)
+        return self._submit('ping', args, kwargs, callback)
+
+    def highstate(self, *args, **kwargs):
+        callback = kwargs.pop('callback', None)
+        return self._submit('highstate', args, kwargs, callback)
+
+    def append_grain(self, *args, **kwargs):
+        callback = kwargs.pop('callback', None)
+        return self._submit('append_grain', args, kwargs, callback)
+
+    def list_grains(self, *args, **kwargs):
+        callback = kwargs.pop('callback', None)
+        return self._submit('list_grains', args, kwargs, callback)
+
+    def close(self):
+        '''Waits for all pending calls and stops the workers.'''
+        self._pool.close()
+        self._pool.join()
+        self.manager.close()
@@ -0,0 +1,153 @@
+###############################################################################
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+
+import collections
+import json
+import threading
+import time
+
+import utils
+
+
+DEFAULT_TTL = 5
+DEFAULT_MAX_ENTRIES = 256
+# Read-only functions, whose results may be reused until the target
+# is written to.
+DEFAULT_CACHEABLE_FUNCTIONS = frozenset([
+        'test.ping',
+        'grains.ls',
+        'grains.get',
+        'grains.item',
+        'grains.items',
+        'pillar.get',
+        'pillar.item',
+        'pillar.items'
+    ])
+
+
+def cache_key(command):
+    '''Returns the key identifying a command's result. -> str'''
+    return json.dumps(command, sort_keys = True, default = repr)
+
+
+def complete(target, tgt_type, result):
+    '''Checks if a result contains every minion the target names. -> bool
+
+    Only such results may be cached: a minion missing from a result
+    (e.g. one which has not connected yet) would otherwise be reported
+    as not responding until the result expires.
+    '''
+    minions = utils.explicit_minions(target, tgt_type)
+    return (bool(minions) and isinstance(result, dict)
+            and all(m in result for m in minions))
+
+
+class _Entry(object):
+
+    def __init__(self, minions, value, expires):
+        self.minions = minions
+        self.value = value
+        self.expires = expires
+
+
+class ResultCache(object):
+    '''A cache of read-only functions' results.
+
+    Results expire after `ttl' seconds and the least recently used ones
+    are evicted once there are more than `max_entries' of them. Results
+    concerning a target are dropped as soon as any other function is
+    called on it. Only results containing every minion named by their
+    target are kept (see `complete'). If the affected minions cannot be
+    told from a target (e.g. a glob), all results possibly concerning
+    them are dropped.
+
+    Interesting methods:
+        * cacheable - checks if a function's results may be cached,
+        * get - returns a cached result,
+        * put - caches a result,
+        * invalidate - drops results concerning the given target,
+        * clear - drops everything.
+    '''
+
+    def __init__(
+            self,
+            ttl = DEFAULT_TTL,
+            max_entries = DEFAULT_MAX_ENTRIES,
+            functions = DEFAULT_CACHEABLE_FUNCTIONS):
+        '''Cache constructor. -> ResultCache
+
+        Arguments:
+            * ttl = the number of seconds results are kept for,
+            * max_entries = the maximum number of results kept,
+            * functions = names of functions whose results are cached.
+        '''
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.functions = frozenset(functions)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def cacheable(self, function):
+        return function in self.functions
+
+    def get(self, key):
+        '''Returns the cached value or None. -> object'''
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry.expires <= time.time():
+                return None
+            self._entries[key] = entry
+            return entry.value
+
+    def put(self, key, target, tgt_type, value):
+        '''Caches a value.
+
+        Arguments:
+            * key = see `cache_key',
+            * target, tgt_type = the command's target and its type,
+            * value = the value to be cached (it should not be modified
+                    afterwards).
+        '''
+        entry = _Entry(
+                utils.explicit_minions(target, tgt_type),
+                value,
+                time.time() + self.ttl
+            )
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+    def invalidate(self, target = None, tgt_type = None):
+        '''Drops results which may concern the given target (all results
+        if the target is None).
+        '''
+        minions = None
+        if target is not None:
+            minions = utils.explicit_minions(target, tgt_type)
+        with self._lock:
+            if minions is None:
+                self._entries.clear()
+                return
+            for key, entry in self._entries.items():
+                if entry.minions is None or entry.minions & minions:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
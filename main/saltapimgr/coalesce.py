@@ -0,0 +1,160 @@
+###############################################################################
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+
+import sys
+import threading
+
+
+DEFAULT_WINDOW = 0.05
+# Functions whose per-minion results do not depend on the other minions
+# targeted by the same job (merging them never runs anything twice).
+COALESCIBLE_FUNCTIONS = frozenset([
+        'test.ping',
+        'grains.ls',
+        'key.accept'
+    ])
+
+_coalescers = {}
+_coalescers_lock = threading.Lock()
+
+
+class _Batch(object):
+
+    def __init__(self):
+        self.targets = []
+        # Set once the batch should be sent without waiting any longer.
+        self.ready = threading.Event()
+        self.done = threading.Event()
+        self.response = None
+        self.result = None
+        self.error = None
+
+
+class Coalescer(object):
+    '''Merges concurrent calls of the same function targeting single
+    minions into one call targeting all of them.
+
+    A caller finding no request of the same kind in flight sends its
+    own at once. Otherwise it opens a batch, which other callers join,
+    and sends it as soon as the request in flight returns, `window'
+    seconds pass or `max_targets' minions join, whichever comes first.
+    The batch's callers receive the part of the result concerning their
+    own minion. A lone caller is thus never delayed.
+
+    Interesting methods:
+        * call - joins (or opens) a batch.
+    '''
+
+    def __init__(self, window = DEFAULT_WINDOW, max_targets = None):
+        '''Coalescer constructor. -> Coalescer
+
+        Arguments:
+            * window = the maximum number of seconds a batch is kept
+                    open,
+            * max_targets = an optional limit of minions in a batch.
+        '''
+        self.window = window
+        self.max_targets = max_targets
+        self._batches = {}
+        # The number of batches being sent, by key.
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _send_when_ready(self, key, batch):
+        # Waits until the batch may be sent and closes it.
+        batch.ready.wait(self.window)
+        with self._lock:
+            if self._batches.get(key) is batch:
+                del self._batches[key]
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+
+    def _sent(self, key):
+        # Lets the batch waiting for the request in flight go.
+        with self._lock:
+            self._in_flight[key] -= 1
+            if not self._in_flight[key]:
+                del self._in_flight[key]
+            waiting = self._batches.get(key)
+            if waiting is not None:
+                waiting.ready.set()
+
+    def _join(self, key, target):
+        # -> (batch, if the caller is its leader)
+        with self._lock:
+            batch = self._batches.get(key)
+            leader = batch is None
+            if leader:
+                batch = _Batch()
+                self._batches[key] = batch
+                if key not in self._in_flight:
+                    batch.ready.set()
+            if target not in batch.targets:
+                batch.targets.append(target)
+            if (self.max_targets is not None
+                    and len(batch.targets) >= self.max_targets):
+                del self._batches[key]
+                batch.ready.set()
+        return batch, leader
+
+    def call(self, key, target, send):
+        '''Calls `send' for a batch of targets. -> (response, result)
+
+        `result' is the sent call's result limited to `target'
+        (an empty dictionary if the minion has not responded).
+        The response is shared between all the batch's callers.
+        Exceptions raised by `send' are raised in every caller.
+
+        Arguments:
+            * key = identifies calls which may be merged (e.g. the API,
+                    the token and the function),
+            * target = a single minion id,
+            * send = a callable taking a list of minion ids and returning
+                    a (response, {minion id: result}) pair.
+        '''
+        batch, leader = self._join(key, target)
+        if leader:
+            self._send_when_ready(key, batch)
+            try:
+                batch.response, batch.result = send(batch.targets)
+            except Exception:
+                batch.error = sys.exc_info()
+            finally:
+                self._sent(key)
+                batch.done.set()
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error[0], batch.error[1], batch.error[2]
+        result = batch.result
+        if isinstance(result, dict) and target in result:
+            return batch.response, {target: result[target]}
+        if isinstance(result, dict):
+            return batch.response, {}
+        return batch.response, result
+
+
+def get_coalescer(window = DEFAULT_WINDOW):
+    '''Returns a process-wide coalescer with the given window. -> Coalescer
+
+    Calls can only be merged if they go through the same coalescer,
+    so managers created independently (e.g. by concurrent operations)
+    should share it.
+    '''
+    with _coalescers_lock:
+        coalescer = _coalescers.get(window)
+        if coalescer is None:
+            coalescer = Coalescer(window)
+            _coalescers[window] = coalescer
+        return coalescer
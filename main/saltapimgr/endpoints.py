@@ -0,0 +1,108 @@
+###############################################################################
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+
+import threading
+import time
+
+
+DEFAULT_EJECTION_TIME = 30
+
+
+class EndpointPool(object):
+    '''A set of equivalent Salt API endpoints.
+
+    Requests are routed to the healthy endpoint with the least
+    outstanding requests (ties are broken in a round-robin fashion).
+    An endpoint which fails (cannot be connected to or answers with
+    a server error) is ejected for `ejection_time' seconds.
+
+    Interesting methods:
+        * acquire - picks an endpoint for a request,
+        * release - reports the request's completion,
+        * healthy - checks if an endpoint is not ejected.
+
+    Interesting properties:
+        * urls - all endpoint URLs, in the given order.
+    '''
+
+    def __init__(self, urls, ejection_time = DEFAULT_EJECTION_TIME):
+        '''Pool constructor. -> EndpointPool
+
+        Arguments:
+            * urls = a URL or a list of URLs to Salt REST APIs,
+            * ejection_time = the number of seconds an endpoint
+                    stays ejected after a failure.
+        '''
+        if isinstance(urls, basestring):
+            urls = [urls]
+        self.urls = list(urls)
+        self._ejection_time = ejection_time
+        self._outstanding = dict((url, 0) for url in self.urls)
+        self._ejected_until = dict((url, 0) for url in self.urls)
+        self._turn = 0
+        self._lock = threading.Lock()
+
+    def healthy(self, url):
+        '''Check if the endpoint is not ejected. -> bool'''
+        return self._ejected_until[url] <= time.time()
+
+    def ordered(self):
+        '''Returns all URLs, the preferred ones first. -> list
+
+        Healthy endpoints come first, ordered by the number
+        of outstanding requests, followed by the ejected ones,
+        ordered by the end of their ejection.
+        '''
+        now = time.time()
+        count = len(self.urls)
+        with self._lock:
+            order = sorted(
+                    range(count),
+                    key = lambda i: (
+                            max(self._ejected_until[self.urls[i]], now),
+                            self._outstanding[self.urls[i]],
+                            (i - self._turn) % count
+                        )
+                )
+        return [self.urls[i] for i in order]
+
+    def acquire(self, pinned = None):
+        '''Picks an endpoint for a request. -> str
+
+        Every `acquire' must be followed by a `release'.
+
+        Arguments:
+            * pinned = if given, this very endpoint is used.
+        '''
+        url = pinned
+        if url is None:
+            url = self.ordered()[0]
+        with self._lock:
+            self._outstanding[url] += 1
+            self._turn = (self.urls.index(url) + 1) % len(self.urls)
+        return url
+
+    def release(self, url, healthy = True):
+        '''Reports the completion of a request sent to the endpoint.
+
+        Arguments:
+            * url = the endpoint URL returned by `acquire',
+            * healthy = if the endpoint has handled the request, if not
+                    it will be ejected.
+        '''
+        with self._lock:
+            self._outstanding[url] -= 1
+            if not healthy:
+                self._ejected_until[url] = time.time() + self._ejection_time
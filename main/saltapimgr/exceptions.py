@@ -19,6 +19,11 @@ TOKEN_HAS_EXPIRED = 3
 TOKEN_IS_STILL_VALID = 4
 NO_COMMAND_SPECIFIED = 5
 EMPTY_COMMAND_LIST_SPECIFIED = 6
+JOB_TIMED_OUT = 7
+RESPONSE_TOO_LARGE = 8
+MALFORMED_RESPONSE = 9
+WHEEL_CALL_FAILED = 10
+NOT_THREAD_SAFE = 11
 
 
 class LogicError(Exception):
@@ -34,12 +39,16 @@ class LogicError(Exception):
             'The token is still valid.',
             'Force clearing of the token if You really want not to log out.'
         )
+    _NOT_THREAD_SAFE_MSG = '{0} {1}'.format(
+            'The manager has not been created thread-safe.',
+            'Cannot send calls concurrently.')
 
     _REASON_TO_MESSAGE = {
             NO_AUTH_DATA: _NO_AUTH_DATA_MSG,
             NO_TOKEN_TO_CLEAR: _NO_TOKEN_TO_CLEAR_MSG,
             TOKEN_HAS_EXPIRED: _TOKEN_HAS_EXPIRED_MSG,
-            TOKEN_IS_STILL_VALID: _TOKEN_IS_STILL_VALID_MSG
+            TOKEN_IS_STILL_VALID: _TOKEN_IS_STILL_VALID_MSG,
+            NOT_THREAD_SAFE: _NOT_THREAD_SAFE_MSG
         }
 
     def __init__(self, reason):
@@ -64,3 +73,50 @@ class InvalidArgument(Exception):
     def __init__(self, reason):
         super(InvalidArgument, self).__init__(
                 self._REASON_TO_MESSAGE[reason])
+
+
+class TimedOut(Exception):
+
+    _JOB_TIMED_OUT_MSG = '{0} {1}'.format(
+            'The job has not finished within the given time.',
+            'It may still be running.')
+
+    _REASON_TO_MESSAGE = {
+            JOB_TIMED_OUT: _JOB_TIMED_OUT_MSG
+        }
+
+    def __init__(self, reason):
+        super(TimedOut, self).__init__(
+                self._REASON_TO_MESSAGE[reason])
+
+
+class InvalidResponse(Exception):
+
+    _RESPONSE_TOO_LARGE_MSG = '{0} {1}'.format(
+            'The response exceeds the maximum allowed size.',
+            'Refusing to read it any further.')
+    _MALFORMED_RESPONSE_MSG = 'The response has an unexpected structure.'
+
+    _REASON_TO_MESSAGE = {
+            RESPONSE_TOO_LARGE: _RESPONSE_TOO_LARGE_MSG,
+            MALFORMED_RESPONSE: _MALFORMED_RESPONSE_MSG
+        }
+
+    def __init__(self, reason):
+        super(InvalidResponse, self).__init__(
+                self._REASON_TO_MESSAGE[reason])
+
+
+class CallFailed(Exception):
+
+    _WHEEL_CALL_FAILED_MSG = '{0} {1}'.format(
+            'The wheel function has failed.',
+            'Check if the user is allowed to call wheel functions.')
+
+    _REASON_TO_MESSAGE = {
+            WHEEL_CALL_FAILED: _WHEEL_CALL_FAILED_MSG
+        }
+
+    def __init__(self, reason):
+        super(CallFailed, self).__init__(
+                self._REASON_TO_MESSAGE[reason])
@@ -27,7 +27,33 @@ _LOG_LEVELS = {
     }
 
 
-def set_up_logger(root_logger, level = None):
+DEFAULT_PAYLOAD_LIMIT = 4096
+
+
+class _Logger(logging.LoggerAdapter):
+    # A manager's own view of the shared child logger, carrying its
+    # payload limit.
+
+    def __init__(self, logger, payload_limit):
+        super(_Logger, self).__init__(logger, {})
+        self.payload_limit = payload_limit
+
+
+def set_up_logger(
+        root_logger,
+        level = None,
+        payload_limit = DEFAULT_PAYLOAD_LIMIT):
+    '''Creates a logger for a single manager. -> logging.LoggerAdapter
+    or None
+
+    Arguments:
+        * root_logger = the logger to create a child of (None disables
+                logging),
+        * level = an optional log level,
+        * payload_limit = the maximum length of a single formatted log
+                argument; longer arguments (like whole call results) are
+                truncated. None disables truncation.
+    '''
     logger = None
     if root_logger is not None:
         logger = root_logger.getChild(manager._LOGGER_MODULE)
@@ -35,33 +61,57 @@ def set_up_logger(root_logger, level = None):
             level = level.lower()
             level = _LOG_LEVELS[level]
             logger.setLevel(level)
+        logger = _Logger(logger, payload_limit)
     return logger
 
 
-def log(logger, level, message):
+def enabled(logger, level):
+    return logger is not None and logger.isEnabledFor(_LOG_LEVELS[level])
+
+
+def _format_payload(arg, limit):
+    text = str(arg).strip()
+    if limit is not None and len(text) > limit:
+        text = '{0}... ({1} more characters)'.format(
+                text[:limit],
+                len(text) - limit
+            )
+    return text
+
+
+def log(logger, level, message, *args):
+    '''Logs the message, formatted with the given arguments.
+
+    Arguments are turned into strings (and truncated) only if the message
+    is actually going to be logged.
+    '''
     assert level in _LOG_LEVELS
-    if logger is not None:
-        getattr(logger, level)(message)
+    if not enabled(logger, level):
+        return
+    if args:
+        limit = getattr(logger, 'payload_limit', DEFAULT_PAYLOAD_LIMIT)
+        message = message.format(*[_format_payload(a, limit) for a in args])
+    getattr(logger, level)(message)
 
 
-def debug(logger, message):
-    log(logger, 'debug', message)
+def debug(logger, message, *args):
+    log(logger, 'debug', message, *args)
 
 
-def info(logger, message):
-    log(logger, 'info', message)
+def info(logger, message, *args):
+    log(logger, 'info', message, *args)
 
 
-def warning(logger, message):
-    log(logger, 'warning', message)
+def warning(logger, message, *args):
+    log(logger, 'warning', message, *args)
 
 
-def error(logger, message):
-    log(logger, 'error', message)
+def error(logger, message, *args):
+    log(logger, 'error', message, *args)
 
 
-def critical(logger, message):
-    log(logger, 'critical', message)
+def critical(logger, message, *args):
+    log(logger, 'critical', message, *args)
 
 
 def cover_auth_data(data, show):
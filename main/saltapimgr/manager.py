@@ -13,10 +13,24 @@
 ###############################################################################
 
 
+import contextlib
+import copy
+import multiprocessing.pool
+import threading
+import time
+
 import requests
 
+import cache
+import coalesce
+import endpoints
 import exceptions
 import log
+import metrics
+import retry
+import sessions
+import templates
+import tokencache
 import utils
 
 
@@ -28,8 +42,56 @@ _NON_DICT_OBJECTS_TREATED_AS_ITERABLE_BY_DEFAULT = (
         xrange
     )
 _DEFAULT_CLIENT = 'local'
+_ASYNC_CLIENT = 'local_async'
+_BATCH_CLIENT = 'local_batch'
+_WHEEL_CLIENT = 'wheel'
+_DEFAULT_JOB_TIMEOUT = 3600
+_DEFAULT_POLL_INTERVAL = 2
+_DEFAULT_POLL_BACKOFF = 1.5
+_DEFAULT_MAX_POLL_INTERVAL = 30
+_DEFAULT_MINION_TIMEOUT = 30
+_DEFAULT_PING_INTERVAL = 1
+_DEFAULT_PING_BACKOFF = 1.5
+_DEFAULT_MAX_PING_INTERVAL = 8
+_DEFAULT_KEY_TIMEOUT = 20
+_DEFAULT_REFRESH_MARGIN = 60
+_UNAUTHORISED = 401
 _LOGGER_MODULE = 'salt'
+# Failures of the endpoint itself (rather than of a request).
+_ENDPOINT_FAILURES = (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        requests.exceptions.ChunkedEncodingError
+    )
 _COVER_AUTH_DATA_WITH = '***'
+# `key.list_all' result keys.
+_ACCEPTED_KEYS = 'minions'
+_PENDING_KEYS = 'minions_pre'
+_REJECTED_KEYS = 'minions_rejected'
+_DENIED_KEYS = 'minions_denied'
+
+# Sent repeatedly (e.g. while waiting for a minion), so compiled once.
+_PING = templates.CommandTemplate('test.ping')
+_LIST_GRAINS = templates.CommandTemplate('grains.ls')
+
+
+def _operation_name(functions):
+    names = []
+    for f in functions:
+        if str(f) not in names:
+            names.append(str(f))
+    return ','.join(names)
+
+
+def _until_deadline(results, deadline):
+    # Raises `TimedOut' once the deadline has passed while iterating.
+    try:
+        for result in results:
+            if deadline is not None and time.time() > deadline:
+                raise exceptions.TimedOut(exceptions.JOB_TIMED_OUT)
+            yield result
+    except requests.exceptions.Timeout:
+        raise exceptions.TimedOut(exceptions.JOB_TIMED_OUT)
 
 
 class SaltRESTManager(object):
@@ -38,19 +100,47 @@ class SaltRESTManager(object):
     Interesting methods:
         * __init__ - constructor,
         * call - raw function call,
+        * call_iter - raw function call with an incrementally parsed
+                response,
+        * call_many - many independent raw function calls sent
+                concurrently,
+        * close - stops the workers of `call_many',
+        * call_template - a call of a precompiled command template,
         * log_in - opens a session,
         * clear_auth_data - clears authorisation data,
         * clear_token - clears a token, without closing an open session,
         * log_out - closes an open session,
         * logged_in - checks if a session is open,
         * ping - a `call' wrapper for the `test.ping' function,
+        * wait_for_minion - waits until a minion connects to the master,
+        * list_keys - lists minion keys known to the master,
+        * accept_keys - accepts pending minion keys,
+        * authorize_minion - accepts a minion's key once the master
+                receives it,
         * highstate - a `call' wrapper for the `state.highstate'
                 function,
+        * submit - submits a function as an asynchronous job,
+        * lookup_job - fetches the current state of a job,
+        * wait_for_job - polls a job until all its targets return,
+        * highstate_iter - executes `state.highstate', yielding
+                results state by state,
+        * highstate_async - executes `state.highstate' as a polled
+                asynchronous job,
         * append_grain - appends a given grain,
+        * apply_grains - appends or sets many grains at once,
         * list_grains - lists all currently used grains.
 
     Interesting properties:
-        * token - token structure, if one has been generated.
+        * token - token structure, if one has been generated,
+        * token_cache - the token cache, if one has been supplied.
+
+    A `TokenCache' may be supplied to share tokens between managers
+    (even living in different processes): `log_in' will then reuse
+    a cached token, as long as it is not about to expire.
+
+    If auth data is available, the token is renewed before a request
+    when it is about to expire, and a request rejected with HTTP 401
+    is sent once more after logging in again.
     '''
 
     def __init__(
@@ -61,7 +151,24 @@ class SaltRESTManager(object):
             session_options = None,
             root_logger = None,
             log_level = None,
-            show_auth_data = False):
+            show_auth_data = False,
+            token_cache = None,
+            pool_size = sessions.DEFAULT_POOL_SIZE,
+            keep_alive = True,
+            codec = utils.YAML,
+            max_response_size = None,
+            pin_token = True,
+            ejection_time = endpoints.DEFAULT_EJECTION_TIME,
+            retry_policy = None,
+            metrics = None,
+            coalescer = None,
+            result_cache = None,
+            refresh_margin = _DEFAULT_REFRESH_MARGIN,
+            relogin = True,
+            thread_safe = False,
+            compress_responses = True,
+            compress_threshold = None,
+            log_payload_limit = log.DEFAULT_PAYLOAD_LIMIT):
         '''Manager constructor. -> SaltRESTManager
 
         Check the Salt's API documentation for auth data and token
@@ -71,8 +178,22 @@ class SaltRESTManager(object):
         options (like disabling SSL certificate checking or supplying
         custom certificates).
 
+        HTTP sessions are shared process-wide between managers using
+        the same API URL and session options (see `sessions').
+
+        Several equivalent API URLs (e.g. of different masters) may be
+        given. Requests are then spread among them, preferring the ones
+        with the least outstanding requests and skipping the ones which
+        have recently failed (see `endpoints'). Unless `pin_token' is
+        disabled, all requests made with a token are sent to the
+        endpoint which has issued it. Once that endpoint is ejected,
+        the manager logs in on another one (if auth data is available),
+        and an idempotent request which has failed meanwhile is sent
+        again (see `retry.RetryPolicy').
+
         Arguments:
-            * api_url = a mandatory URL to Salt REST API,
+            * api_url = a mandatory URL (or a list of URLs) to Salt
+                    REST API,
             * auth_data = an optional dictionary containing proper
                     authorisation data accepted by Salt `login'
                     API call,
@@ -86,21 +207,369 @@ class SaltRESTManager(object):
                     either a string or a predefined int from
                     the `logging' library,
             * show_auth_data = optionally the manager can be configured
-                    not to cover auth data.
+                    not to cover auth data,
+            * token_cache = an optional `TokenCache' instance to take
+                    tokens from and store them in,
+            * pool_size = the maximum number of connections to the API
+                    kept open,
+            * keep_alive = (yes by default) if connections should be
+                    kept open between requests,
+            * codec = the wire format of requests and responses, either
+                    a `utils.Codec' or its name (`yaml' by default),
+            * max_response_size = the default maximum size in bytes
+                    of streamed responses (unlimited by default),
+            * pin_token = (yes by default) if requests made with a token
+                    should be sent to the endpoint which has issued it
+                    (required unless the eauth tokens are shared between
+                    the masters),
+            * ejection_time = the number of seconds a failed endpoint
+                    is skipped for,
+            * retry_policy = an optional `retry.RetryPolicy' deciding
+                    which failed requests are sent again (by default
+                    nothing is retried),
+            * metrics = an optional `metrics.MetricsRegistry' to record
+                    every request in,
+            * coalescer = an optional `coalesce.Coalescer' merging
+                    concurrent `ping', `list_grains' and `authorize_minion'
+                    calls targeting single minions (see `coalesce'),
+            * result_cache = an optional `cache.ResultCache' to reuse
+                    results of read-only functions from (see `cache'),
+            * refresh_margin = if auth data is available, the token is
+                    renewed before a request once it is due to expire
+                    within this number of seconds,
+            * relogin = (yes by default) if a request rejected with
+                    HTTP 401 should be sent again once with a new token
+                    (requires auth data),
+            * thread_safe = if the manager is going to be used by many
+                    threads at once: every request then borrows an HTTP
+                    session from a pool of at most `pool_size' sessions
+                    (`requests' sessions are not guaranteed to be
+                    thread-safe), and `call_many' may be used,
+            * compress_responses = (yes by default) if gzip or deflate
+                    encoded responses should be accepted,
+            * compress_threshold = if given, command request bodies
+                    of at least this many bytes are sent gzip encoded
+                    (the API, or a proxy in front of it, has to support
+                    such requests),
+            * log_payload_limit = the maximum length of a single logged
+                    argument (like a call result), longer ones are
+                    truncated (None disables truncation).
         '''
-        self._session = None
-        self._api_url = api_url
+        self._sessions = {}
+        self._endpoints = endpoints.EndpointPool(api_url, ejection_time)
+        self._pin_token = pin_token
+        self._retry_policy = retry_policy or retry.NO_RETRIES
+        self._metrics = metrics
         self._auth_data = auth_data
         self._session_options = session_options
         self._show_auth_data = show_auth_data
-        self.token = token
-        self.logger = log.set_up_logger(root_logger, log_level)
+        # The token and the URL of the endpoint which has issued it (None
+        # if unknown), swapped together.
+        self._token_state = (token, None)
+        self.logger = log.set_up_logger(
+                root_logger,
+                log_level,
+                log_payload_limit
+            )
+        self._token_cache = token_cache
+        self._pool_size = pool_size
+        self._keep_alive = keep_alive
+        self._codec = utils.get_codec(codec)
+        self._max_response_size = max_response_size
+        self._coalescer = coalescer
+        self._result_cache = result_cache
+        self._refresh_margin = refresh_margin
+        self._relogin = relogin
+        self._thread_safe = thread_safe
+        self._compress_responses = compress_responses
+        self._compress_threshold = compress_threshold
+        self._workers = None
+        # Serialises logging in, so concurrent callers of an expired token
+        # do not all log in at once.
+        self._lock = threading.RLock()
+
+    @property
+    def token(self):
+        '''The token structure, if one has been generated. -> dict'''
+        return self._token_state[0]
+
+    @token.setter
+    def token(self, token):
+        self._token_state = (token, None)
+
+    def _set_token(self, token, endpoint):
+        self._token_state = (token, endpoint)
+
+    @property
+    def token_cache(self):
+        '''The token cache in use, if any. -> TokenCache or None'''
+        return self._token_cache
+
+    def _token_cache_key(self, url):
+        return tokencache.cache_key(url, self._auth_data)
+
+    @contextlib.contextmanager
+    def _lend_session(self, url):
+        if self._thread_safe:
+            # Replaced as a whole when the session options change.
+            pools = self._sessions
+            pool = pools.get(url)
+            if pool is None:
+                pool = pools.setdefault(url, sessions.SessionPool(
+                        self._pool_size,
+                        self._session_options,
+                        self._pool_size,
+                        self._keep_alive,
+                        self._compress_responses
+                    ))
+            with pool.session() as session:
+                yield session
+            return
+        session = self._sessions.get(url)
+        if session is None:
+            session = sessions.get_session(
+                    url,
+                    self._session_options,
+                    self._pool_size,
+                    self._keep_alive,
+                    self._compress_responses
+                )
+            self._sessions[url] = session
+        yield session
+
+    def _pinned_endpoint(self, token, endpoint):
+        if not self._pin_token or token is None:
+            return None
+        if endpoint is None:
+            # A token supplied from the outside is assumed to have been
+            # issued by the first endpoint.
+            return self._endpoints.urls[0]
+        return endpoint
+
+    def _send_once(self, send, pin, timeout, operation, attempt):
+        token, endpoint = self._token_state
+        url = self._pinned_endpoint(token, endpoint) if pin else None
+        url = self._endpoints.acquire(url)
+        healthy = False
+        status = None
+        stats = {}
+        started = time.time()
+        try:
+            with self._lend_session(url) as session:
+                response, result = send(session, url, token, timeout, stats)
+            status = response.status_code
+            healthy = status < 500
+            return response, result
+        except _ENDPOINT_FAILURES:
+            raise
+        except Exception:
+            # Raised on the client side (e.g. a response which is too
+            # large or malformed): the endpoint has done its part.
+            healthy = True
+            raise
+        finally:
+            if self._metrics is not None:
+                self._metrics.record(metrics.CallRecord(
+                        operation,
+                        url,
+                        status,
+                        time.time() - started,
+                        stats.get('request_bytes', 0),
+                        stats.get('response_bytes'),
+                        stats.get('parse_time', 0),
+                        attempt,
+                        stats.get('request_wire_bytes'),
+                        stats.get('response_wire_bytes')
+                    ))
+            self._endpoints.release(url, healthy)
+            if not healthy:
+                log.warning(
+                        self.logger,
+                        'endpoint {0} has failed, ejecting it',
+                        url
+                    )
+
+    def _retry_delay(self, policy, attempt, started):
+        # -> the delay before the next attempt or None, if there should be
+        # no more attempts.
+        if attempt >= policy.max_attempts:
+            return None
+        delay = policy.delay(attempt)
+        remaining = policy.timeout(started)
+        if remaining is not None and remaining <= delay:
+            return None
+        return delay
+
+    def _fail_over(self):
+        # Logs in on another endpoint if the one which has issued
+        # the token has been ejected. -> if the token has been replaced
+        token, endpoint = self._token_state
+        url = self._pinned_endpoint(token, endpoint)
+        if (url is None or self._auth_data is None
+                or self._endpoints.healthy(url)
+                or not any(self._endpoints.healthy(u)
+                        for u in self._endpoints.urls if u != url)):
+            return False
+        with self._lock:
+            if self._token_state[0] is not token:
+                # Another thread has already done it.
+                return True
+            log.warning(
+                    self.logger,
+                    'endpoint {0} has been ejected, logging in on another'
+                    ' one',
+                    url
+                )
+            # The token is still valid on its endpoint, so it is kept
+            # in the token cache.
+            self._set_token(None, None)
+            self._log_in(None, None, True)
+        return self.token is not None
+
+    def _send_with_retries(
+            self, send, operation, pin, functions, fail_over = False):
+        # -> (response, result), retrying the request according to
+        # the retry policy. With `fail_over', attempts are not sent to
+        # an ejected endpoint the token is pinned to.
+        policy = self._retry_policy
+        retryable = policy.idempotent([f for f in functions if f])
+        started = time.time()
+        attempt = 1
+        while True:
+            if fail_over:
+                self._fail_over()
+            try:
+                response, result = self._send_once(
+                        send,
+                        pin,
+                        policy.timeout(started),
+                        operation,
+                        attempt
+                    )
+            except Exception as e:
+                if not retryable or not policy.retryable_exception(e):
+                    raise
+                delay = self._retry_delay(policy, attempt, started)
+                if delay is None:
+                    raise
+                log.warning(
+                        self.logger,
+                        'attempt {0} failed: {1}, retrying in {2}s',
+                        attempt,
+                        e,
+                        round(delay, 2)
+                    )
+            else:
+                if not retryable or not policy.retryable_response(response):
+                    return response, result
+                delay = self._retry_delay(policy, attempt, started)
+                if delay is None:
+                    return response, result
+                log.warning(
+                        self.logger,
+                        'attempt {0} failed with HTTP return code = {1},'
+                        ' retrying in {2}s',
+                        attempt,
+                        response.status_code,
+                        round(delay, 2)
+                    )
+            time.sleep(delay)
+            attempt += 1
+
+    def _refresh_token(self):
+        # Renews the token if it is about to expire (and can be renewed).
+        token = self.token
+        if (self._auth_data is None or token is None
+                or utils.token_valid(token, self._refresh_margin)):
+            return
+        with self._lock:
+            if self.token is not token:
+                # Another thread has already renewed it.
+                return
+            log.info(
+                    self.logger,
+                    'refresh token: token \'{0}\' is about to expire',
+                    token['token']
+                )
+            self._discard_token()
+            self.log_in()
+            if self.token is not None and not utils.token_valid(
+                    self.token, self._refresh_margin):
+                # Another manager has cached a token which is about
+                # to expire as well.
+                self._discard_token()
+                self.log_in(use_cache = False)
+
+    def _discard_token(self):
+        # Forgets the current token, evicting it from the token cache.
+        token, endpoint = self._token_state
+        if self._token_cache is not None and token is not None:
+            self._token_cache.discard(
+                    self._token_cache_key(
+                            endpoint or self._endpoints.urls[0]),
+                    token
+                )
+        self._set_token(None, None)
+
+    def _dispatch(
+            self,
+            send,
+            operation,
+            pin = True,
+            functions = (),
+            authenticated = False):
+        # Sends a request with `send(session, url, token, timeout, stats)'
+        # -> (response, result), reporting the endpoint's health and
+        # retrying the request according to the retry policy.
+        # Requests `authenticated' with the token are sent with a fresh
+        # token and, if rejected, sent once more after logging in again.
+        if authenticated:
+            self._refresh_token()
+        token = self.token
+        fail_over = authenticated and pin and self._pin_token
+        try:
+            response, result = self._send_with_retries(
+                    send, operation, pin, functions, fail_over)
+        except _ENDPOINT_FAILURES:
+            # The endpoint the token is pinned to has gone away: the
+            # request is sent to another one, if it is safe to repeat.
+            if (not fail_over
+                    or not self._retry_policy.idempotent(
+                            [f for f in functions if f])
+                    or not self._fail_over()):
+                raise
+            token = self.token
+            response, result = self._send_with_retries(
+                    send, operation, pin, functions, fail_over)
+        if (not authenticated
+                or response.status_code != _UNAUTHORISED
+                or not self._relogin
+                or self._auth_data is None):
+            return response, result
+        with self._lock:
+            # Unless another thread has already done it.
+            if self.token is token:
+                log.warning(
+                        self.logger,
+                        '{0}: the token has been rejected, logging in again',
+                        operation
+                    )
+                self._discard_token()
+                self.log_in(use_cache = False)
+        if self.token is None:
+            return response, result
+        return self._send_with_retries(
+                send, operation, pin, functions, fail_over)
 
     def logged_in(self):
         '''Check if a session is open. -> bool'''
-        return self.token is not None and not utils.token_valid(self.token)
+        return self.token is not None and utils.token_valid(self.token)
 
-    def log_in(self, auth_data = None, session_options = None):
+    def log_in(
+            self,
+            auth_data = None,
+            session_options = None,
+            use_cache = True):
         '''Open a session. -> (requests.Response, result)
 
         `result' is a parsed output data structure.
@@ -108,65 +577,98 @@ class SaltRESTManager(object):
         If auth data had not been supplied in the constructor,
         it can be here.
 
+        If a token cache has been configured and it holds a valid token
+        for this API URL and eauth identity, no request is sent at all:
+        the response is None and the result is the cached token.
+
         Arguments:
             * auth_data = an optional dictionary containing
                     the authorisation data (explicit auth data has 
-                    a higher priority).
+                    a higher priority),
+            * use_cache = (yes by default) if a cached token may be used.
         '''
+        with self._lock:
+            return self._log_in(auth_data, session_options, use_cache)
+
+    def _log_in(self, auth_data, session_options, use_cache):
         if auth_data is not None:
             self._auth_data = auth_data
         if session_options is not None:
             self._session_options = session_options
+            self._sessions = {}
         if self._auth_data is None:
             log.error(
                     self.logger,
                     'log in: missing auth data'
                 )
             raise exceptions.LogicError(exceptions.NO_AUTH_DATA)
-        if self._session is None:
-            params = {}
-            if self._session_options is not None:
-                params = self._session_options
-            self._session = requests.Session(**params)
+        if not use_cache or self._token_cache is None:
+            return self._send_login()
+        # Managers needing a token at the same time (even in other
+        # processes) wait for the first one's instead of logging in too.
+        with self._token_cache.locked():
+            for url in self._endpoints.ordered():
+                if not self._endpoints.healthy(url):
+                    continue
+                cached = self._token_cache.get(self._token_cache_key(url))
+                if cached is not None:
+                    self._set_token(cached, url)
+                    log.info(
+                            self.logger,
+                            'log in: reusing cached token = {0}',
+                            self.token['token']
+                        )
+                    return None, cached
+            return self._send_login()
+
+    def _send_login(self):
         log.debug(
                 self.logger,
                 'log in: logging in with auth data = {0}'
-                ' and session options = {1}'.format(
-                        log.cover_auth_data(
-                                self._auth_data,
-                                self._show_auth_data
-                            ),
-                        str(self._session_options).strip()
-                    )
-            )
-        response, result = utils.send_login_request(
-                self._session,
-                self._api_url,
-                self._auth_data,
-                self.logger
+                ' and session options = {1}',
+                log.cover_auth_data(
+                        self._auth_data,
+                        self._show_auth_data
+                    ),
+                self._session_options
             )
+        issuers = []
+
+        def send(session, url, token, timeout, stats):
+            issuers.append(url)
+            return utils.send_login_request(
+                    session,
+                    url,
+                    self._auth_data,
+                    self.logger,
+                    self._codec,
+                    timeout,
+                    stats
+                )
+
+        response, result = self._dispatch(send, 'login', pin = False)
+        url = issuers[-1]
         if result:
-            self.token = result
+            self._set_token(result, url)
+            if self._token_cache is not None:
+                self._token_cache.put(self._token_cache_key(url), result)
             log.info(
                     self.logger,
-                    'log in: successfully logged in, token = {0}'.format(
-                            str(self.token['token']).strip()
-                        )
+                    'log in: successfully logged in, token = {0}',
+                    self.token['token']
                 )
             log.debug(
                     self.logger,
-                    'log in: token = {0}'.format(
-                            str(self.token).strip()
-                        )
+                    'log in: token = {0}',
+                    self.token
                 )
         else:
             log.info(
                     self.logger,
                     'log in: failed to log in, HTTP return code = {0},'
-                    ' reason = \'{1}\''. format(
-                            str(response.status_code).strip(),
-                            str(response.reason).strip()
-                        )
+                    ' reason = \'{1}\'',
+                    response.status_code,
+                    response.reason
                 )
         return response, result
 
@@ -182,14 +684,14 @@ class SaltRESTManager(object):
                 ** THROW (default),
                 ** SILENTLY_IGNORE.
         '''
-        if self.auth_data is None:
+        if self._auth_data is None:
             ERR_MSG = 'clear auth data: auth data not set'
             if validation == SaltRESTManager.THROW:
                 log.error(self.logger, ERR_MSG)
-                raise exceptions.LogicError(exception.NO_AUTH_DATA)
+                raise exceptions.LogicError(exceptions.NO_AUTH_DATA)
             else:
                 log.warning(self.logger, ERR_MSG)
-        self.auth_data = None
+        self._auth_data = None
 
     def clear_token(self, validation = THROW):
         '''Clears the token without invalidating it.
@@ -215,13 +717,10 @@ class SaltRESTManager(object):
             ERR_MSG = 'clear token: the token is still valid'
             if validation == SaltRESTManager.THROW:
                 log.error(self.logger, ERR_MSG)
-                raise exception.LogicError(exception.TOKEN_IS_STILL_VALID)
+                raise exceptions.LogicError(exceptions.TOKEN_IS_STILL_VALID)
             else:
                 log.warning(self.logger, ERR_MSG)
-        self.token = None
-        if self._session is not None:
-            self._session.close()
-            self._session = None
+        self._set_token(None, None)
 
     def log_out(self, validation = THROW):
         '''Close the session, if it was open. -> (requests.Response, result)
@@ -235,11 +734,12 @@ class SaltRESTManager(object):
                 ** THROW (default),
                 ** SILENTLY_IGNORE.
         '''
+        token, endpoint = self._token_state
         try:
-            if self.token is None:
+            if token is None:
                 ERR_MSG = 'log out: no token to invalidate'
                 raise exceptions.LogicError(exceptions.NO_TOKEN_TO_CLEAR)
-            elif not utils.token_valid(self.token):
+            elif not utils.token_valid(token):
                 ERR_MSG = 'log out: the token has already expired'
                 self.token = None
                 raise exceptions.LogicError(exceptions.TOKEN_HAS_EXPIRED)
@@ -252,46 +752,108 @@ class SaltRESTManager(object):
                 return None, None
         log.debug(
                 self.logger,
-                'log out: invalidating token \'{0}\''.format(
-                        str(self.token['token']).strip()
-                    )
-            )
-        response, result = utils.send_logout_request(
-                self._session,
-                self._api_url,
-                self.token,
-                self.logger
+                'log out: invalidating token \'{0}\'',
+                token['token']
             )
+        if self._token_cache is not None:
+            self._token_cache.discard(
+                    self._token_cache_key(endpoint or self._endpoints.urls[0]),
+                    token
+                )
+
+        def send(session, url, current_token, timeout, stats):
+            # The token being invalidated is sent, even if it has been
+            # replaced in the meantime.
+            return utils.send_logout_request(
+                    session,
+                    url,
+                    token,
+                    self.logger,
+                    self._codec,
+                    timeout,
+                    stats
+                )
+
+        response, result = self._dispatch(send, 'logout')
         if response.ok:
             log.info(
                     self.logger,
-                    'log out: succesfully cleared token \'{0}\''.format(
-                            str(self.token['token']).strip()
-                        )
+                    'log out: succesfully cleared token \'{0}\'',
+                    token['token']
                 )
         else:
             log.info(
                     self.logger,
                     'log out: failed to clear token \'{0}\','
-                    ' HTTP return code = {1}, reason = \'{2}\''.format(
-                            str(self.token['token']).strip(),
-                            str(response.status_code).strip(),
-                            str(response.reason).strip()
-                        )
+                    ' HTTP return code = {1}, reason = \'{2}\'',
+                    token['token'],
+                    response.status_code,
+                    response.reason
                 )
-        self._session.close()
-        self._session = None
-        self.token = None
+        self._set_token(None, None)
         return response, result
 
     DEFAULT_ACTION = 0
     INTERPRET_AS_COLLECTION = 1
     RAW_INTERPRETATION = 2
 
+    def _translate(self, func, action, use_yaml, codec):
+        # -> (serialised commands, single, codec, function names, commands)
+        if codec is None:
+            codec = self._codec
+        else:
+            codec = utils.get_codec(codec)
+        if (((action is None or action == SaltRESTManager.DEFAULT_ACTION)
+                and isinstance(
+                        func,
+                        _NON_DICT_OBJECTS_TREATED_AS_ITERABLE_BY_DEFAULT))
+                or action == SaltRESTManager.INTERPRET_AS_COLLECTION):
+            single = False
+            log.debug(self.logger, 'call: transforming collection into a list')
+        else:
+            single = True
+            log.debug(self.logger, 'call: wrapping function in a list')
+            func = [func]
+
+        commands = utils.collection_translation(
+            func,
+            self.logger,
+            codec if use_yaml else None
+        )
+        functions = [utils.function_name(c) for c in func]
+        return commands, single, codec, functions, func
+
+    def _result_cache_key(self, func, single):
+        # -> the cache key of a single cacheable command or None
+        if self._result_cache is None or not single:
+            return None
+        command = func[0]
+        if (not isinstance(command, dict)
+                or command.get('client') != _DEFAULT_CLIENT
+                or not self._result_cache.cacheable(command.get('fun'))):
+            return None
+        return cache.cache_key(command)
+
+    def _invalidate_results(self, func):
+        # Drops cached results concerning the commands' targets.
+        if self._result_cache is None:
+            return
+        for command in func:
+            if self._result_cache.cacheable(utils.function_name(command)):
+                continue
+            target, tgt_type = utils.command_target(command)
+            log.debug(
+                    self.logger,
+                    'call: invalidating cached results for \'{0}\'',
+                    target
+                )
+            self._result_cache.invalidate(target, tgt_type)
+
     def call(self,
              func,
              action = DEFAULT_ACTION,
-             use_yaml = True):
+             use_yaml = True,
+             codec = None):
         '''Calls the requested function(s) using a raw call
         to the REST API. -> (requests.Response, results)
 
@@ -304,8 +866,8 @@ class SaltRESTManager(object):
         dictionaries and strings will be treated as multiple requests,
         unless explicitly specified otherwise.
 
-        By default, the request will be in YAML, if possible,
-        unless explicitly specified otherwise.
+        By default, the request will be serialised with the manager's
+        codec, unless explicitly specified otherwise.
 
         If it is possible to inspect the parameters (if dictionary
         interface is available) and if `client' parameter has not been
@@ -327,61 +889,668 @@ class SaltRESTManager(object):
                 * INTERPRET_AS_COLLECTION,
                 * RAW_INTERPRETATION,
             * use_yaml = (yes by default) if the function call should be
-                    in YAML.
+                    serialised at all (the name is kept for compatibility),
+            * codec = an optional codec (or codec name) to be used for
+                    this call only.
         '''
-        if (((action is None or action == SaltRESTManager.DEFAULT_ACTION)
-                and isinstance(
-                        func,
-                        _NON_DICT_OBJECTS_TREATED_AS_ITERABLE_BY_DEFAULT))
-                or action == SaltRESTManager.INTERPRET_AS_COLLECTION):
-            single = False
-            log.debug(self.logger, 'call: transforming collection into a list')
+        commands, single, codec, functions, func = self._translate(
+                func, action, use_yaml, codec)
+        key = self._result_cache_key(func, single)
+        if key is not None:
+            cached = self._cached_result(key)
+            if cached is not None:
+                return cached
         else:
-            single = True
-            log.debug(self.logger, 'call: wrapping function in a list')
-            func = [func]
+            self._invalidate_results(func)
 
-        commands = utils.collection_translation(
-            func,
-            self.logger,
-            use_yaml
-        )
-        response, result = utils.send_command_request(
-                self._session,
-                self._api_url,
-                self.token,
-                commands,
-                single,
-                self.logger,
-                use_yaml
+        def send(session, url, token, timeout, stats):
+            return utils.send_command_request(
+                    session,
+                    url,
+                    token,
+                    commands,
+                    single,
+                    self.logger,
+                    codec,
+                    use_yaml,
+                    timeout,
+                    stats,
+                    self._compress_threshold
+                )
+
+        response, result = self._dispatch(
+                send,
+                _operation_name(functions),
+                functions = functions,
+                authenticated = True
             )
+        self._called(key, func, response, result)
+        return response, result
+
+    def _cached_result(self, key):
+        # -> a copy of the cached (response, result) or None
+        cached = self._result_cache.get(key)
+        if cached is None:
+            return None
+        log.debug(self.logger, 'call: using cached results')
+        return cached[0], copy.deepcopy(cached[1])
+
+    def _called(self, key, func, response, result):
+        # Logs the outcome of a call, caching its result under `key'.
         if response.ok:
             log.info(
                     self.logger,
                     'call: successfully called the given commands'
                 )
+            if key is not None:
+                target, tgt_type = utils.command_target(func[0])
+                # Partial results (like an empty ping) are not answers.
+                if cache.complete(target, tgt_type, result):
+                    self._result_cache.put(
+                            key,
+                            target,
+                            tgt_type,
+                            (response, copy.deepcopy(result))
+                        )
             log.debug(
                     self.logger,
-                    'call: results = \'{0}\''.format(
-                            str(result).strip()
-                        )
+                    'call: results = \'{0}\'',
+                    result
                 )
         else:
             log.info(
                     self.logger,
                     'call: failed to call given commands,'
-                    ' HTTP return code = {0}, reason = \'{1}\''.format(
-                            str(response.status_code).strip(),
-                            str(response.reason).strip()
-                        )
+                    ' HTTP return code = {0}, reason = \'{1}\'',
+                    response.status_code,
+                    response.reason
+                )
+
+    def call_template(
+            self,
+            template,
+            target,
+            args = (),
+            tgt_type = None,
+            codec = None,
+            use_cache = True):
+        '''Calls a precompiled command template on the given target.
+        -> (requests.Response, result)
+
+        Behaves like `call' with a single function, but the request
+        is built (and serialised) only once for every distinct call
+        (see `templates.CommandTemplate').
+
+        Arguments:
+            * template = a `templates.CommandTemplate',
+            * target = the target,
+            * args = arguments appended to the template's fixed ones,
+            * tgt_type = an optional target type (like `list'),
+            * codec = an optional codec (or codec name) to be used for
+                    this call only,
+            * use_cache = (yes by default) if a cached result may be
+                    returned (a fresh one is cached anyway).
+        '''
+        if codec is None:
+            codec = self._codec
+        else:
+            codec = utils.get_codec(codec)
+        func = None
+        key = None
+        if self._result_cache is not None:
+            func = [template.command(target, args, tgt_type)]
+            key = self._result_cache_key(func, True)
+            if key is not None:
+                cached = self._cached_result(key) if use_cache else None
+                if cached is not None:
+                    return cached
+            else:
+                self._invalidate_results(func)
+
+        def send(session, url, token, timeout, stats):
+            return utils.send_prepared_command_request(
+                    session,
+                    template.prepare(
+                            session,
+                            url,
+                            token,
+                            codec,
+                            target,
+                            args,
+                            tgt_type
+                        ),
+                    True,
+                    self.logger,
+                    codec,
+                    timeout,
+                    stats,
+                    self._compress_threshold
                 )
+
+        response, result = self._dispatch(
+                send,
+                template.function,
+                functions = [template.function],
+                authenticated = True
+            )
+        self._called(key, func, response, result)
         return response, result
 
+    def call_iter(
+            self,
+            func,
+            action = DEFAULT_ACTION,
+            use_yaml = True,
+            codec = None,
+            per_state = False,
+            max_size = None,
+            timeout = None):
+        '''Calls the requested function(s) like `call', but parses
+        the response incrementally. -> (requests.Response, iterator)
+
+        The iterator yields (command index, minion, result) tuples or,
+        if `per_state' is set, (command index, minion, state, result)
+        tuples, so only a single minion's (or state's) result is kept
+        in memory at a time. It is None if the call has failed.
+
+        The response body is streamed and the connection is released
+        once the iterator is exhausted or closed, so the iterator should
+        always be consumed or closed.
+
+        Arguments:
+            * func, action, use_yaml, codec = as in `call' (`codec' only
+                    applies to the request, responses are always YAML),
+            * per_state = if results should be split into states,
+            * max_size = the maximum response size in bytes (defaults
+                    to the manager's `max_response_size'); exceeding it
+                    raises `InvalidResponse' while iterating,
+            * timeout = an optional maximum number of seconds to wait
+                    for the response (or any part of it).
+        '''
+        commands, single, codec, functions, func = self._translate(
+                func, action, use_yaml, codec)
+        self._invalidate_results(func)
+        if max_size is None:
+            max_size = self._max_response_size
+        call_timeout = timeout
+
+        def send(session, url, token, timeout, stats):
+            if call_timeout is not None:
+                timeout = min(t for t in (timeout, call_timeout)
+                              if t is not None)
+            return utils.send_streamed_command_request(
+                    session,
+                    url,
+                    token,
+                    commands,
+                    self.logger,
+                    codec,
+                    use_yaml,
+                    max_size,
+                    per_state,
+                    timeout,
+                    stats,
+                    self._compress_threshold
+                )
+
+        response, results = self._dispatch(
+                send,
+                _operation_name(functions),
+                functions = functions,
+                authenticated = True
+            )
+        if not response.ok:
+            log.info(
+                    self.logger,
+                    'call iter: failed to call given commands,'
+                    ' HTTP return code = {0}, reason = \'{1}\'',
+                    response.status_code,
+                    response.reason
+                )
+        return response, results
+
+    def _coalescible(self, function, target):
+        return (self._coalescer is not None
+                and function in coalesce.COALESCIBLE_FUNCTIONS
+                and self.token is not None
+                and isinstance(target, basestring)
+                and utils.explicit_minions(target) is not None)
+
+    def _coalesced_call(self, template, target, use_cache = True):
+        # Calls a template on the target, merging the call with concurrent
+        # ones if possible. -> (requests.Response, result)
+        if not self._coalescible(template.function, target):
+            return self.call_template(
+                    template, target, use_cache = use_cache)
+
+        def send(targets):
+            if targets == [target]:
+                # Nobody has joined: the call is sent as it is.
+                return self.call_template(
+                        template, target, use_cache = use_cache)
+            log.debug(
+                    self.logger,
+                    'coalesced call: {0} on {1}',
+                    template.function,
+                    targets
+                )
+            return self.call_template(
+                    template,
+                    list(targets),
+                    (),
+                    'list',
+                    use_cache = use_cache
+                )
+
+        key = (
+                tuple(self._endpoints.urls),
+                self.token.get('token'),
+                template.function,
+                use_cache
+            )
+        return self._coalescer.call(key, target, send)
+
+    def _get_workers(self):
+        with self._lock:
+            if self._workers is None:
+                self._workers = multiprocessing.pool.ThreadPool(
+                        self._pool_size)
+            return self._workers
+
+    def call_many(self, funcs, use_yaml = True, codec = None):
+        '''Calls many independent functions concurrently.
+        -> list of (requests.Response, results)
+
+        Every function (or collection of functions) is sent in its own
+        request by the manager's workers (at most `pool_size' requests
+        are in flight), and the results are returned in the order
+        of `funcs'. If any call raises an exception, it is raised once
+        all the calls have finished.
+
+        Raises `LogicError' unless the manager has been created
+        `thread_safe'.
+
+        Arguments:
+            * funcs = a list of functions, as accepted by `call',
+            * use_yaml, codec = see `call'.
+        '''
+        if not self._thread_safe:
+            raise exceptions.LogicError(exceptions.NOT_THREAD_SAFE)
+        funcs = list(funcs)
+        if not funcs:
+            return []
+        return self._get_workers().map(
+                lambda func: self.call(
+                        func,
+                        use_yaml = use_yaml,
+                        codec = codec
+                    ),
+                funcs,
+                chunksize = 1
+            )
+
+    def close(self):
+        '''Stops the workers of `call_many' and closes idle sessions
+        owned by the manager.
+        '''
+        with self._lock:
+            workers = self._workers
+            self._workers = None
+        if workers is not None:
+            workers.close()
+            workers.join()
+        if self._thread_safe:
+            for pool in self._sessions.values():
+                pool.close()
+
     def ping(self, target):
         '''Pings the given target(s). -> (requests.Response, result)'''
-        return self.call(
-                {'tgt': target, 'fun': 'test.ping'},
-                use_yaml=True
+        return self._coalesced_call(_PING, target)
+
+    def _minion_responds(self, minion_id):
+        # Readiness is always checked with a fresh ping.
+        response, result = self._coalesced_call(
+                _PING, minion_id, use_cache = False)
+        return response.ok and bool(result) and minion_id in result
+
+    def _open_event_stream(self, operation, timeout):
+        # -> the API's event stream (a streamed requests.Response)
+        # or None if it is unavailable
+        def send(session, url, token, request_timeout, stats):
+            stream = utils.open_event_stream(
+                    session,
+                    url,
+                    token,
+                    self.logger,
+                    timeout,
+                    stats
+                )
+            return stream, None
+
+        try:
+            stream, _ = self._dispatch(send, 'events', authenticated = True)
+        except requests.exceptions.RequestException as e:
+            log.warning(
+                    self.logger,
+                    '{0}: event stream unavailable: {1}',
+                    operation,
+                    e
+                )
+            return None
+        if not stream.ok:
+            log.warning(
+                    self.logger,
+                    '{0}: event stream unavailable,'
+                    ' HTTP return code = {1}, reason = \'{2}\'',
+                    operation,
+                    stream.status_code,
+                    stream.reason
+                )
+            stream.close()
+            return None
+        return stream
+
+    def _minion_ready_event(self, minion_id, tag, data):
+        if not isinstance(data, dict):
+            data = {}
+        if tag == 'salt/minion/{0}/start'.format(minion_id):
+            return True
+        if tag == 'minion_start' and data.get('id') == minion_id:
+            return True
+        # An accepted authentication is not enough by itself: the minion
+        # still has to connect to the publisher, so it is confirmed with
+        # a ping.
+        if (tag == 'salt/auth' and data.get('id') == minion_id
+                and data.get('act') == 'accept'):
+            return self._minion_responds(minion_id)
+        return False
+
+    def _wait_for_minion_events(self, minion_id, stream, deadline):
+        try:
+            for tag, data in utils.iter_events(stream):
+                if self._minion_ready_event(minion_id, tag, data):
+                    return True
+                if time.time() >= deadline:
+                    return False
+        except requests.exceptions.RequestException as e:
+            log.warning(
+                    self.logger,
+                    'wait for minion: event stream broken: {0}',
+                    e
+                )
+        return None
+
+    def _wait_for_minion_pings(
+            self,
+            minion_id,
+            deadline,
+            ping_interval,
+            ping_backoff,
+            max_ping_interval):
+        interval = ping_interval
+        while True:
+            if self._minion_responds(minion_id):
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+            interval = min(interval * ping_backoff, max_ping_interval)
+
+    def wait_for_minion(
+            self,
+            minion_id,
+            timeout = _DEFAULT_MINION_TIMEOUT,
+            ping_interval = _DEFAULT_PING_INTERVAL,
+            ping_backoff = _DEFAULT_PING_BACKOFF,
+            max_ping_interval = _DEFAULT_MAX_PING_INTERVAL):
+        '''Waits until the given minion is connected to the master. -> bool
+
+        The API's event stream is watched for the minion's `start' event
+        (or for its accepted authentication, confirmed with a single
+        ping). Only if the event stream is unavailable, the minion is
+        pinged repeatedly, the interval between pings starting at
+        `ping_interval' and being multiplied by `ping_backoff', up to
+        `max_ping_interval' seconds.
+
+        Arguments:
+            * minion_id = the minion identifier,
+            * timeout = the maximum number of seconds to wait,
+            * ping_interval = the initial interval between pings,
+            * ping_backoff = the interval multiplier,
+            * max_ping_interval = the maximum interval between pings.
+        '''
+        deadline = time.time() + timeout
+        stream = self._open_event_stream('wait for minion', timeout)
+        try:
+            # The minion might have connected before the stream was open.
+            if self._minion_responds(minion_id):
+                return True
+            if stream is not None:
+                ready = self._wait_for_minion_events(
+                        minion_id, stream, deadline)
+                if ready is not None:
+                    return ready
+        finally:
+            if stream is not None:
+                stream.close()
+        log.info(
+                self.logger,
+                'wait for minion: falling back to pinging {0}',
+                minion_id
+            )
+        return self._wait_for_minion_pings(
+                minion_id,
+                deadline,
+                ping_interval,
+                ping_backoff,
+                max_ping_interval
+            )
+
+    def _call_wheel(self, function, **kwargs):
+        # -> (requests.Response, the wheel function's return or None)
+        command = dict(kwargs)
+        command['client'] = _WHEEL_CLIENT
+        command['fun'] = function
+        response, result = self.call(command)
+        if not response.ok:
+            return response, None
+        data = result.get('data') if isinstance(result, dict) else None
+        if not isinstance(data, dict) or not data.get('success', True):
+            log.info(
+                    self.logger,
+                    '{0}: the wheel function has failed: {1}',
+                    function,
+                    result
+                )
+            return response, None
+        return response, data.get('return')
+
+    def list_keys(self):
+        '''Lists minion keys known to the master.
+        -> (requests.Response, result)
+
+        `result' is a dictionary of minion id lists, one per key state:
+        `minions' (accepted), `minions_pre' (pending), `minions_rejected'
+        and `minions_denied'. It is None if the keys could not be listed.
+        '''
+        return self._call_wheel('key.list_all')
+
+    def accept_keys(self, minion_ids):
+        '''Accepts pending keys of all the given minions in a single
+        call. -> (requests.Response, result)
+
+        `result' is a list of minions whose keys have been accepted
+        (None if the call has failed). Keys which are not pending
+        (e.g. already accepted) are left alone.
+
+        Arguments:
+            * minion_ids = a list of minion identifiers.
+        '''
+        response, result = self._call_wheel(
+                'key.accept',
+                match = list(minion_ids)
+            )
+        if isinstance(result, dict):
+            result = result.get(_ACCEPTED_KEYS) or []
+        return response, result
+
+    def _key_state(self, minion_id):
+        # -> the state of the minion's key (like `minions_pre') or None
+        response, keys = self.list_keys()
+        if not isinstance(keys, dict):
+            raise exceptions.CallFailed(exceptions.WHEEL_CALL_FAILED)
+        for state in (
+                _ACCEPTED_KEYS, _PENDING_KEYS, _REJECTED_KEYS, _DENIED_KEYS):
+            if minion_id in (keys.get(state) or []):
+                return state
+        return None
+
+    def _accept_key(self, minion_id):
+        # Accepts a single pending key, merging the call with concurrent
+        # ones if possible. -> bool
+        if not self._coalescible('key.accept', minion_id):
+            response, accepted = self.accept_keys([minion_id])
+        else:
+            def send(targets):
+                log.debug(
+                        self.logger,
+                        'coalesced call: key.accept on {0}',
+                        targets
+                    )
+                response, accepted = self.accept_keys(targets)
+                if accepted is None:
+                    return response, None
+                return response, dict((m, True) for m in accepted)
+
+            key = (
+                    tuple(self._endpoints.urls),
+                    self.token.get('token'),
+                    'key.accept'
+                )
+            response, accepted = self._coalescer.call(key, minion_id, send)
+        if accepted is None:
+            raise exceptions.CallFailed(exceptions.WHEEL_CALL_FAILED)
+        return minion_id in accepted
+
+    def _try_accepting_key(self, minion_id):
+        # -> True if the key is accepted, False if it has been rejected
+        # or denied, None if it has not been received yet
+        state = self._key_state(minion_id)
+        if state == _PENDING_KEYS:
+            if self._accept_key(minion_id):
+                log.info(
+                        self.logger,
+                        'authorize minion: accepted the key of {0}',
+                        minion_id
+                    )
+                return True
+            # Possibly accepted concurrently by someone else.
+            state = self._key_state(minion_id)
+        if state == _ACCEPTED_KEYS:
+            return True
+        if state in (_REJECTED_KEYS, _DENIED_KEYS):
+            log.warning(
+                    self.logger,
+                    'authorize minion: the key of {0} is in {1}',
+                    minion_id,
+                    state
+                )
+            return False
+        return None
+
+    def _wait_for_key_events(self, minion_id, stream, deadline):
+        try:
+            for tag, data in utils.iter_events(stream):
+                if (tag == 'salt/auth' and isinstance(data, dict)
+                        and data.get('id') == minion_id):
+                    accepted = self._try_accepting_key(minion_id)
+                    if accepted is not None:
+                        return accepted
+                if time.time() >= deadline:
+                    return False
+        except requests.exceptions.RequestException as e:
+            log.warning(
+                    self.logger,
+                    'authorize minion: event stream broken: {0}',
+                    e
+                )
+        return None
+
+    def _wait_for_key_polls(
+            self,
+            minion_id,
+            deadline,
+            poll_interval,
+            poll_backoff,
+            max_poll_interval):
+        interval = poll_interval
+        while True:
+            accepted = self._try_accepting_key(minion_id)
+            if accepted is not None:
+                return accepted
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+            interval = min(interval * poll_backoff, max_poll_interval)
+
+    def authorize_minion(
+            self,
+            minion_id,
+            timeout = _DEFAULT_KEY_TIMEOUT,
+            poll_interval = _DEFAULT_PING_INTERVAL,
+            poll_backoff = _DEFAULT_PING_BACKOFF,
+            max_poll_interval = _DEFAULT_MAX_PING_INTERVAL):
+        '''Accepts the given minion's key as soon as the master receives
+        it. -> bool
+
+        Returns False if the key has not been received within `timeout'
+        seconds, or if it has been rejected or denied.
+
+        Keys are managed with the `wheel' client, so the user has to be
+        allowed to call wheel functions; otherwise `CallFailed' is raised.
+        The API's event stream is watched for the minion's authentication
+        attempts. Only if the event stream is unavailable, the keys are
+        listed repeatedly, the interval between listings starting at
+        `poll_interval' and being multiplied by `poll_backoff', up to
+        `max_poll_interval' seconds. Keys of minions authorised
+        concurrently (by managers sharing a coalescer) are accepted
+        in a single call.
+
+        Arguments:
+            * minion_id = the minion identifier,
+            * timeout = the maximum number of seconds to wait,
+            * poll_interval = the initial interval between listings,
+            * poll_backoff = the interval multiplier,
+            * max_poll_interval = the maximum interval between listings.
+        '''
+        deadline = time.time() + timeout
+        stream = self._open_event_stream('authorize minion', timeout)
+        try:
+            # The key might have been received before the stream was open.
+            accepted = self._try_accepting_key(minion_id)
+            if accepted is not None:
+                return accepted
+            if stream is not None:
+                accepted = self._wait_for_key_events(
+                        minion_id, stream, deadline)
+                if accepted is not None:
+                    return accepted
+        finally:
+            if stream is not None:
+                stream.close()
+        log.info(
+                self.logger,
+                'authorize minion: falling back to listing keys of {0}',
+                minion_id
+            )
+        return self._wait_for_key_polls(
+                minion_id,
+                deadline,
+                poll_interval,
+                poll_backoff,
+                max_poll_interval
             )
 
     def highstate(self, target):
@@ -389,8 +1558,212 @@ class SaltRESTManager(object):
         -> (requests.Response, result)
         '''
         return self.call(
+                {'tgt': target, 'fun': 'state.highstate'}
+            )
+
+    def highstate_iter(self, target, max_size = None):
+        '''Executes `highstate' on given target, yielding the result
+        state by state. -> (requests.Response, iterator)
+
+        The iterator yields (minion, state, result) tuples. See
+        `call_iter' for details.
+        '''
+        response, results = self.call_iter(
                 {'tgt': target, 'fun': 'state.highstate'},
-                use_yaml=True
+                per_state=True,
+                max_size=max_size
+            )
+        if results is not None:
+            results = (r[1:] for r in results)
+        return response, results
+
+    def highstate_batch(
+            self,
+            target,
+            batch,
+            tgt_type = None,
+            max_size = None,
+            timeout = None):
+        '''Executes `highstate' on given target(s) in batches, using
+        the `local_batch' client. -> (requests.Response, iterator)
+
+        The master runs at most `batch' of the targeted highstates at
+        a time, starting another one whenever one finishes. The iterator
+        yields (minion, result) tuples while the response is being
+        parsed, so only a single minion's result is kept in memory
+        at a time. See `call_iter' for details.
+
+        `local_batch' calls are synchronous, so the request is held
+        open for the whole run. `exceptions.TimedOut' is raised if it
+        has not finished within `timeout' seconds (the master may still
+        be running the highstates then).
+
+        Arguments:
+            * target = the target(s),
+            * batch = the maximum number of minions executing
+                    highstate at once, or a percentage of the targeted
+                    minions (like `10%'),
+            * tgt_type = an optional target type (like `list'),
+            * max_size = see `call_iter',
+            * timeout = an optional maximum number of seconds to wait.
+        '''
+        command = {
+                'client': _BATCH_CLIENT,
+                'tgt': target,
+                'fun': 'state.highstate',
+                'batch': str(batch)
+            }
+        if tgt_type is not None:
+            utils.set_target_type(command, tgt_type)
+        deadline = None if timeout is None else time.time() + timeout
+        try:
+            response, results = self.call_iter(
+                    command, max_size = max_size, timeout = timeout)
+        except requests.exceptions.Timeout:
+            raise exceptions.TimedOut(exceptions.JOB_TIMED_OUT)
+        if results is not None:
+            results = _until_deadline((r[1:] for r in results), deadline)
+        return response, results
+
+    def submit(self, func):
+        '''Submits the given function through the asynchronous client.
+        -> (requests.Response, result)
+
+        `result' is a dictionary containing the `jid' of the created job
+        and the list of targeted `minions'.
+        '''
+        func = dict(func)
+        func['client'] = _ASYNC_CLIENT
+        response, result = self.call(func)
+        if response.ok:
+            log.info(
+                    self.logger,
+                    'submit: created job \'{0}\'',
+                    result.get('jid')
+                )
+        return response, result
+
+    def lookup_job(self, jid):
+        '''Fetches the current state of the given job.
+        -> (requests.Response, result)
+
+        `result' is a dictionary containing the job's `info' and
+        the `return' data of all targets which have returned so far.
+        '''
+
+        def send(session, url, token, timeout, stats):
+            return utils.send_job_request(
+                    session,
+                    url,
+                    token,
+                    jid,
+                    self.logger,
+                    self._codec,
+                    timeout,
+                    stats
+                )
+
+        return self._dispatch(send, 'jobs', authenticated = True)
+
+    def wait_for_job(
+            self,
+            jid,
+            minions,
+            timeout = _DEFAULT_JOB_TIMEOUT,
+            poll_interval = _DEFAULT_POLL_INTERVAL,
+            poll_backoff = _DEFAULT_POLL_BACKOFF,
+            max_poll_interval = _DEFAULT_MAX_POLL_INTERVAL):
+        '''Polls the given job until all the given minions have returned.
+        -> (requests.Response, result)
+
+        `result' maps minion identifiers to their return data.
+
+        The interval between consecutive polls starts at `poll_interval'
+        and is multiplied by `poll_backoff' after every poll, up to
+        `max_poll_interval' seconds.
+
+        Arguments:
+            * jid = the job identifier,
+            * minions = a collection of minions expected to return,
+            * timeout = the maximum number of seconds to wait,
+            * poll_interval = the initial interval between polls,
+            * poll_backoff = the interval multiplier,
+            * max_poll_interval = the maximum interval between polls.
+
+        Raises `TimedOut', if the job has not finished in time.
+        '''
+        deadline = time.time() + timeout
+        expected = set(minions)
+        interval = poll_interval
+        while True:
+            response, result = self.lookup_job(jid)
+            if response.ok:
+                returned = result['return']
+                if expected.issubset(returned):
+                    log.info(
+                            self.logger,
+                            'wait for job: job \'{0}\' has finished',
+                            jid
+                        )
+                    return response, returned
+                log.debug(
+                        self.logger,
+                        'wait for job: job \'{0}\' still waiting'
+                        ' for {1}',
+                        jid,
+                        sorted(expected - set(returned))
+                    )
+            else:
+                log.warning(
+                        self.logger,
+                        'wait for job: failed to look up job \'{0}\','
+                        ' HTTP return code = {1}, reason = \'{2}\'',
+                        jid,
+                        response.status_code,
+                        response.reason
+                    )
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                log.error(
+                        self.logger,
+                        'wait for job: job \'{0}\' timed out',
+                        jid
+                    )
+                raise exceptions.TimedOut(exceptions.JOB_TIMED_OUT)
+            time.sleep(min(interval, remaining))
+            interval = min(interval * poll_backoff, max_poll_interval)
+
+    def highstate_async(
+            self,
+            target,
+            timeout = _DEFAULT_JOB_TIMEOUT,
+            poll_interval = _DEFAULT_POLL_INTERVAL,
+            poll_backoff = _DEFAULT_POLL_BACKOFF,
+            max_poll_interval = _DEFAULT_MAX_POLL_INTERVAL):
+        '''Executes `highstate' on given target as an asynchronous job
+        and waits for it to finish. -> (requests.Response, result)
+
+        Unlike `highstate', no HTTP request is held open while the
+        states are being applied. See `wait_for_job' for the meaning
+        of the polling arguments.
+        '''
+        response, result = self.submit(
+                {'tgt': target, 'fun': 'state.highstate'})
+        if not response.ok:
+            return response, None
+        if not result or 'jid' not in result:
+            log.warning(
+                    self.logger,
+                    'highstate async: no minions matched the target'
+                )
+            return response, {}
+        return self.wait_for_job(
+                result['jid'],
+                result.get('minions', []),
+                timeout,
+                poll_interval,
+                poll_backoff,
+                max_poll_interval
             )
 
     def append_grain(self, target, grain, value):
@@ -402,15 +1775,62 @@ class SaltRESTManager(object):
                         'tgt': target,
                         'fun': 'grains.append',
                         'arg': [grain, value]
-                    },
-                use_yaml=True
+                    }
             )
 
     def list_grains(self, target):
         '''Returns a list containg all grains.
         -> (requests.Response, result)
         '''
-        return self.call(
-                {'tgt': target, 'fun': 'grains.ls'},
-                use_yaml=True
+        return self._coalesced_call(_LIST_GRAINS, target)
+
+    APPEND_GRAINS = 'grains.append'
+    SET_GRAINS = 'grains.setval'
+
+    def apply_grains(
+            self,
+            target,
+            grains,
+            function = APPEND_GRAINS,
+            read_back = True):
+        '''Applies all the given grains on all targets in a single request.
+        -> (requests.Response, result)
+
+        `result' is a dictionary with two keys:
+            * applied - a list of (grain, value, succeeded) tuples,
+                    in the order of `grains'; a grain has succeeded
+                    if every responding target accepted it,
+            * grains - the `list_grains' result, read back within
+                    the same request (None if not requested).
+
+        Arguments:
+            * target = the target(s),
+            * grains = a list of (grain, value) pairs,
+            * function = one of:
+                * APPEND_GRAINS (default),
+                * SET_GRAINS,
+            * read_back = (yes by default) if the resulting grains
+                    should be listed.
+        '''
+        commands = [
+                {'tgt': target, 'fun': function, 'arg': [grain, value]}
+                for grain, value in grains
+            ]
+        if read_back:
+            commands.append({'tgt': target, 'fun': 'grains.ls'})
+        response, results = self.call(
+                commands,
+                SaltRESTManager.INTERPRET_AS_COLLECTION
             )
+        if not response.ok:
+            return response, None
+        applied = []
+        for (grain, value), returned in zip(grains, results):
+            succeeded = bool(returned) and all(
+                    isinstance(r, dict) for r in returned.itervalues())
+            applied.append((grain, value, succeeded))
+        result = {
+                'applied': applied,
+                'grains': results[len(grains)] if read_back else None
+            }
+        return response, result
@@ -0,0 +1,295 @@
+###############################################################################
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+
+import contextlib
+import fcntl
+import os
+import threading
+
+
+_PROMETHEUS_PREFIX = 'saltapi'
+_LOCK_FILE_SUFFIX = '.lock'
+
+
+class CallRecord(object):
+    '''A single request sent to Salt API.
+
+    Interesting properties:
+        * function - the Salt function name(s) or the API operation
+                (`login', `logout', `jobs', `events'),
+        * url - the endpoint URL,
+        * status - the HTTP status or None, if no response was received,
+        * elapsed - the number of seconds the request took,
+        * request_bytes - the size of the request body,
+        * response_bytes - the size of the decoded response body (None
+                if it is not known, e.g. it has been streamed),
+        * parse_time - the number of seconds spent parsing the response,
+        * attempt - the (1-based) attempt number,
+        * request_wire_bytes, response_wire_bytes - the sizes of the
+                bodies as sent and received, possibly compressed (None
+                if not known).
+    '''
+
+    def __init__(
+            self,
+            function,
+            url,
+            status,
+            elapsed,
+            request_bytes = 0,
+            response_bytes = None,
+            parse_time = 0,
+            attempt = 1,
+            request_wire_bytes = None,
+            response_wire_bytes = None):
+        self.function = function
+        self.url = url
+        self.status = status
+        self.elapsed = elapsed
+        self.request_bytes = request_bytes
+        self.response_bytes = response_bytes
+        self.parse_time = parse_time
+        self.attempt = attempt
+        self.request_wire_bytes = request_wire_bytes
+        self.response_wire_bytes = response_wire_bytes
+
+    @property
+    def failed(self):
+        return self.status is None or self.status >= 400
+
+
+class _Totals(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.request_wire_bytes = 0
+        self.response_wire_bytes = 0
+        self.parse_seconds = 0.0
+
+    def add(self, record):
+        self.calls += 1
+        if record.failed:
+            self.errors += 1
+        self.seconds += record.elapsed
+        self.max_seconds = max(self.max_seconds, record.elapsed)
+        self.request_bytes += record.request_bytes or 0
+        self.response_bytes += record.response_bytes or 0
+        self.request_wire_bytes += record.request_wire_bytes or 0
+        self.response_wire_bytes += record.response_wire_bytes or 0
+        self.parse_seconds += record.parse_time or 0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class MetricsRegistry(object):
+    '''Aggregates call records and phase timings.
+
+    Interesting methods:
+        * add_hook - registers a callable receiving every record,
+        * record - adds a call record,
+        * observe_phase - adds a phase duration,
+        * summary - per-function totals,
+        * phases - per-phase totals,
+        * clear - forgets everything recorded so far.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hooks = []
+        self._functions = {}
+        self._phases = {}
+        # What has been added to textfiles so far, by path.
+        self._written = {}
+
+    def add_hook(self, hook):
+        '''Registers a callable to be called with every `CallRecord'.'''
+        self._hooks.append(hook)
+
+    def record(self, record):
+        with self._lock:
+            self._functions.setdefault(record.function, _Totals()).add(record)
+        for hook in self._hooks:
+            hook(record)
+
+    def observe_phase(self, phase, seconds):
+        with self._lock:
+            totals = self._phases.setdefault(phase, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def summary(self):
+        '''Returns per-function totals. -> dict
+
+        Each value is a dictionary of: calls, errors, seconds,
+        max_seconds, request_bytes, response_bytes, request_wire_bytes,
+        response_wire_bytes and parse_seconds.
+        '''
+        with self._lock:
+            return dict(
+                    (f, t.as_dict()) for f, t in self._functions.iteritems())
+
+    def phases(self):
+        '''Returns per-phase totals. -> dict
+
+        Each value is a dictionary of: count and seconds.
+        '''
+        with self._lock:
+            return dict(
+                    (p, {'count': c, 'seconds': s})
+                    for p, (c, s) in self._phases.iteritems())
+
+    def clear(self):
+        with self._lock:
+            self._functions.clear()
+            self._phases.clear()
+            self._written.clear()
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _families(registry, prefix):
+    # -> [(name, kind, help text, {sample: value})], a sample being
+    # the name with its labels
+    metrics = [
+            ('calls_total', 'calls', 'counter',
+                    'Requests sent to Salt API.'),
+            ('errors_total', 'errors', 'counter',
+                    'Requests which failed.'),
+            ('seconds_total', 'seconds', 'counter',
+                    'Time spent on requests.'),
+            ('max_seconds', 'max_seconds', 'gauge',
+                    'The longest request.'),
+            ('request_bytes_total', 'request_bytes', 'counter',
+                    'Request body bytes sent.'),
+            ('response_bytes_total', 'response_bytes', 'counter',
+                    'Response body bytes received (decoded).'),
+            ('request_wire_bytes_total', 'request_wire_bytes', 'counter',
+                    'Request body bytes sent over the wire.'),
+            ('response_wire_bytes_total', 'response_wire_bytes', 'counter',
+                    'Response body bytes received over the wire.'),
+            ('parse_seconds_total', 'parse_seconds', 'counter',
+                    'Time spent parsing responses.')
+        ]
+    families = []
+    summary = registry.summary()
+    for name, key, kind, help_text in metrics:
+        full_name = '{0}_call_{1}'.format(prefix, name)
+        families.append((full_name, kind, help_text, dict(
+                ('{0}{{function="{1}"}}'.format(
+                        full_name, _escape_label(function)),
+                    totals[key])
+                for function, totals in summary.iteritems())))
+    phases = registry.phases()
+    for name, key, help_text in (
+            ('count', 'count', 'Phases executed.'),
+            ('seconds_total', 'seconds', 'Time spent in phases.')):
+        full_name = '{0}_phase_{1}'.format(prefix, name)
+        families.append((full_name, 'counter', help_text, dict(
+                ('{0}{{phase="{1}"}}'.format(
+                        full_name, _escape_label(phase)),
+                    totals[key])
+                for phase, totals in phases.iteritems())))
+    return families
+
+
+def _prometheus_lines(families):
+    for name, kind, help_text, samples in families:
+        yield '# HELP {0} {1}'.format(name, help_text)
+        yield '# TYPE {0} {1}'.format(name, kind)
+        for sample in sorted(samples):
+            yield '{0} {1}'.format(sample, samples[sample])
+
+
+def _read_samples(path):
+    # -> {sample: value} of an existing textfile
+    samples = {}
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except (IOError, OSError):
+        return samples
+    for line in lines:
+        if line.startswith('#') or not line.strip():
+            continue
+        sample, _, value = line.strip().rpartition(' ')
+        for parse in (int, float):
+            try:
+                samples[sample] = parse(value)
+                break
+            except ValueError:
+                continue
+    return samples
+
+
+@contextlib.contextmanager
+def _locked(path):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def write_prometheus_textfile(registry, path, prefix = _PROMETHEUS_PREFIX):
+    '''Adds the registry to a file in the Prometheus text format.
+
+    Every process on the host may write to the same file: counts
+    recorded since the registry's previous write are added to the ones
+    already in the file (the gauges keep the maximum), under a lock.
+    The file is replaced atomically, so it can be safely picked up
+    by the node exporter's textfile collector at any time.
+    '''
+    families = _families(registry, prefix)
+    with _locked(path + _LOCK_FILE_SUFFIX):
+        existing = _read_samples(path)
+        written = registry._written.get(path, {})
+        merged = []
+        for name, kind, help_text, samples in families:
+            totals = dict(
+                    (s, v) for s, v in existing.iteritems()
+                    if s.split('{', 1)[0] == name)
+            for sample, value in samples.iteritems():
+                if kind == 'gauge':
+                    totals[sample] = max(totals.get(sample, value), value)
+                else:
+                    totals[sample] = (totals.get(sample, 0) + value
+                            - written.get(sample, 0))
+            merged.append((name, kind, help_text, totals))
+        tmp_path = '{0}.{1}.{2}.tmp'.format(
+                path,
+                os.getpid(),
+                threading.current_thread().ident
+            )
+        with open(tmp_path, 'w') as f:
+            for line in _prometheus_lines(merged):
+                f.write(line + '\n')
+        os.rename(tmp_path, path)
+        registry._written[path] = dict(
+                (s, v) for _, _, _, samples in families
+                for s, v in samples.iteritems())
+
+
+# A process-wide registry, for callers which do not need their own.
+REGISTRY = MetricsRegistry()
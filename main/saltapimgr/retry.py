@@ -0,0 +1,137 @@
+###############################################################################
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+
+import random
+import time
+
+import requests
+
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 10
+DEFAULT_RETRYABLE_STATUSES = frozenset([502, 503, 504])
+DEFAULT_RETRYABLE_EXCEPTIONS = (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout
+    )
+# Read-only functions, which may be safely executed more than once.
+# Writes (even seemingly idempotent ones, like `grains.setval') are
+# retried only if a caller adds them to its policy.
+DEFAULT_IDEMPOTENT_FUNCTIONS = frozenset([
+        'test.ping',
+        'grains.ls',
+        'grains.get',
+        'grains.item',
+        'grains.items',
+        'pillar.get',
+        'pillar.item',
+        'pillar.items',
+        'jobs.lookup_jid',
+        'jobs.list_jobs',
+        'key.list',
+        'key.list_all'
+    ])
+
+
+class RetryPolicy(object):
+    '''Decides which failed requests are sent again, and when.
+
+    A request is retried if it has failed with one of the retryable
+    exceptions or HTTP statuses, as long as every Salt function it
+    carries is idempotent (or non-idempotent retries are explicitly
+    allowed). Consecutive attempts are separated by exponentially
+    growing, randomised ("full jitter") delays.
+
+    Interesting methods:
+        * idempotent - checks if the given functions may be retried,
+        * retryable_response - checks if a response is worth a retry,
+        * retryable_exception - checks if an exception is worth a retry,
+        * delay - computes the delay before the given attempt,
+        * timeout - computes the time left until the deadline.
+    '''
+
+    def __init__(
+            self,
+            max_attempts = DEFAULT_MAX_ATTEMPTS,
+            base_delay = DEFAULT_BASE_DELAY,
+            max_delay = DEFAULT_MAX_DELAY,
+            deadline = None,
+            jitter = True,
+            statuses = DEFAULT_RETRYABLE_STATUSES,
+            exceptions = DEFAULT_RETRYABLE_EXCEPTIONS,
+            idempotent_functions = DEFAULT_IDEMPOTENT_FUNCTIONS,
+            retry_non_idempotent = False):
+        '''Policy constructor. -> RetryPolicy
+
+        Arguments:
+            * max_attempts = the maximum number of attempts (including
+                    the first one),
+            * base_delay = the delay before the first retry (before
+                    jitter is applied),
+            * max_delay = the upper bound of a single delay,
+            * deadline = an optional number of seconds after which
+                    a call is given up (and its requests time out),
+            * jitter = (yes by default) if delays should be randomised,
+            * statuses = retryable HTTP statuses,
+            * exceptions = a tuple of retryable exception classes,
+            * idempotent_functions = names of functions safe to retry
+                    (read-only ones by default),
+            * retry_non_idempotent = if other functions (like
+                    `state.highstate') may be retried as well.
+        '''
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.jitter = jitter
+        self.statuses = frozenset(statuses)
+        self.exceptions = tuple(exceptions)
+        self.idempotent_functions = frozenset(idempotent_functions)
+        self.retry_non_idempotent = retry_non_idempotent
+
+    def idempotent(self, functions):
+        '''Check if a request carrying the given functions may be
+        retried. -> bool
+        '''
+        if self.retry_non_idempotent:
+            return True
+        return all(f in self.idempotent_functions for f in functions)
+
+    def retryable_response(self, response):
+        return response.status_code in self.statuses
+
+    def retryable_exception(self, exception):
+        return isinstance(exception, self.exceptions)
+
+    def delay(self, attempt):
+        '''Returns the number of seconds to wait before the given
+        (1-based) retry. -> float
+        '''
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def timeout(self, started):
+        '''Returns the number of seconds left until the deadline of a call
+        started at `started', or None if there is no deadline. -> float
+        '''
+        if self.deadline is None:
+            return None
+        return max(0, started + self.deadline - time.time())
+
+
+NO_RETRIES = RetryPolicy(max_attempts = 1)
@@ -0,0 +1,187 @@
+###############################################################################
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+
+import contextlib
+import threading
+
+import requests
+import requests.adapters
+
+
+DEFAULT_POOL_SIZE = 10
+_COMPRESSED_ENCODINGS = 'gzip, deflate'
+_IDENTITY_ENCODING = 'identity'
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _registry_key(
+        api_url,
+        session_options,
+        pool_size,
+        keep_alive,
+        compress_responses):
+    options = ()
+    if session_options:
+        options = tuple(sorted(
+                (k, repr(v)) for k, v in session_options.iteritems()))
+    return (
+            str(api_url).rstrip('/'),
+            options,
+            pool_size,
+            keep_alive,
+            compress_responses
+        )
+
+
+def create_session(
+        session_options = None,
+        pool_size = DEFAULT_POOL_SIZE,
+        keep_alive = True,
+        compress_responses = True):
+    '''Creates a new, unshared session. -> requests.Session
+
+    See `get_session' for the arguments.
+    '''
+    session = requests.Session()
+    if session_options:
+        for k, v in session_options.iteritems():
+            setattr(session, k, v)
+    adapter = requests.adapters.HTTPAdapter(
+            pool_connections = pool_size,
+            pool_maxsize = pool_size
+        )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    if compress_responses:
+        session.headers['Accept-Encoding'] = _COMPRESSED_ENCODINGS
+    else:
+        session.headers['Accept-Encoding'] = _IDENTITY_ENCODING
+    return session
+
+
+def get_session(
+        api_url,
+        session_options = None,
+        pool_size = DEFAULT_POOL_SIZE,
+        keep_alive = True,
+        compress_responses = True):
+    '''Returns a process-wide session for the given API. -> requests.Session
+
+    Sessions are shared between all callers asking for the same API URL
+    with the same options, so warm keep-alive connections are reused.
+
+    Arguments:
+        * api_url = URL to Salt REST API,
+        * session_options = an optional dictionary of `requests.Session'
+                attributes to be set (like `verify' or `cert'),
+        * pool_size = the maximum number of connections kept open,
+        * keep_alive = if connections should be kept open between
+                requests,
+        * compress_responses = if gzip or deflate encoded responses
+                should be accepted.
+    '''
+    key = _registry_key(
+            api_url,
+            session_options,
+            pool_size,
+            keep_alive,
+            compress_responses
+        )
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = create_session(
+                    session_options,
+                    pool_size,
+                    keep_alive,
+                    compress_responses
+                )
+            _sessions[key] = session
+        return session
+
+
+class SessionPool(object):
+    '''A bounded pool of sessions, each used by one thread at a time.
+
+    Sessions are created when no idle one is left, up to `max_sessions';
+    further threads wait until a session is returned.
+
+    Interesting methods:
+        * session - a context manager lending a session,
+        * close - closes all idle sessions.
+    '''
+
+    def __init__(
+            self,
+            max_sessions,
+            session_options = None,
+            pool_size = DEFAULT_POOL_SIZE,
+            keep_alive = True,
+            compress_responses = True):
+        '''Pool constructor. -> SessionPool
+
+        Arguments:
+            * max_sessions = the maximum number of sessions lent at once,
+            * session_options, pool_size, keep_alive, compress_responses
+                    = see `get_session'.
+        '''
+        self._available = threading.BoundedSemaphore(max(1, max_sessions))
+        self._idle = []
+        self._lock = threading.Lock()
+        self._session_options = session_options
+        self._pool_size = pool_size
+        self._keep_alive = keep_alive
+        self._compress_responses = compress_responses
+
+    @contextlib.contextmanager
+    def session(self):
+        '''Lends a session for the duration of the block.'''
+        self._available.acquire()
+        try:
+            with self._lock:
+                session = self._idle.pop() if self._idle else None
+            if session is None:
+                session = create_session(
+                        self._session_options,
+                        self._pool_size,
+                        self._keep_alive,
+                        self._compress_responses
+                    )
+            try:
+                yield session
+            finally:
+                with self._lock:
+                    self._idle.append(session)
+        finally:
+            self._available.release()
+
+    def close(self):
+        '''Closes all idle sessions.'''
+        with self._lock:
+            for session in self._idle:
+                session.close()
+            del self._idle[:]
+
+
+def close_all():
+    '''Closes all registered sessions and empties the registry.'''
+    with _sessions_lock:
+        for session in _sessions.itervalues():
+            session.close()
+        _sessions.clear()
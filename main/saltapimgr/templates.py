@@ -0,0 +1,136 @@
+###############################################################################
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+
+import collections
+import threading
+
+import manager
+import utils
+
+
+DEFAULT_MAX_PREPARED = 64
+
+
+class CommandTemplate(object):
+    '''A Salt function with fixed arguments, compiled once.
+
+    Calls differ only by their target and, optionally, arguments
+    appended to the fixed ones. The serialised body and the prepared
+    HTTP request of every such call are kept (the `max_prepared' most
+    recently used ones), so repeating a call (like a `test.ping' of
+    the same minion) costs neither serialisation nor request building.
+
+    Interesting methods:
+        * command - builds the lowstate command of a call,
+        * prepare - returns a prepared request of a call.
+
+    Interesting properties:
+        * function - the Salt function name.
+    '''
+
+    def __init__(
+            self,
+            function,
+            arg = None,
+            kwarg = None,
+            client = None,
+            max_prepared = DEFAULT_MAX_PREPARED,
+            **fields):
+        '''Template constructor. -> CommandTemplate
+
+        Arguments:
+            * function = the Salt function name (like `test.ping'),
+            * arg = an optional list of fixed positional arguments,
+            * kwarg = an optional dictionary of keyword arguments,
+            * client = the client (`local' by default),
+            * max_prepared = the maximum number of prepared requests kept,
+            * fields = any other fixed lowstate fields.
+        '''
+        self.function = function
+        self._fields = dict(fields)
+        self._fields['fun'] = function
+        self._fields['client'] = client or manager._DEFAULT_CLIENT
+        if kwarg:
+            self._fields['kwarg'] = dict(kwarg)
+        self._arg = list(arg or [])
+        self._max_prepared = max_prepared
+        self._prepared = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def command(self, target, args = (), tgt_type = None):
+        '''Builds the lowstate command of a call. -> dict
+
+        Arguments:
+            * target = the target,
+            * args = arguments appended to the fixed ones,
+            * tgt_type = an optional target type (like `list').
+        '''
+        command = dict(self._fields)
+        command['tgt'] = target
+        if tgt_type is not None:
+            utils.set_target_type(command, tgt_type)
+        arg = self._arg + list(args)
+        if arg:
+            command['arg'] = arg
+        return command
+
+    def prepare(
+            self,
+            session,
+            base_url,
+            token,
+            codec,
+            target,
+            args = (),
+            tgt_type = None):
+        '''Returns a prepared request of a call. -> requests.PreparedRequest
+
+        Arguments:
+            * session = the `requests.Session' the request is going to be
+                    sent with,
+            * base_url = the API URL,
+            * token = the token the request should carry (or None),
+            * codec = the `utils.Codec' to serialise the request with,
+            * target, args, tgt_type = see `command'.
+        '''
+        # Sessions may add headers of their own.
+        key = (
+                id(session),
+                base_url,
+                token['token'] if token else None,
+                codec.name,
+                repr(target),
+                repr(args),
+                tgt_type
+            )
+        with self._lock:
+            prepared = self._prepared.pop(key, None)
+            if prepared is not None:
+                self._prepared[key] = prepared
+                return prepared.copy()
+        prepared = utils._prepare_command_request(
+                session,
+                base_url,
+                token,
+                codec.dump([self.command(target, args, tgt_type)]),
+                codec,
+                True,
+                codec.content_type
+            )
+        with self._lock:
+            self._prepared[key] = prepared
+            while len(self._prepared) > self._max_prepared:
+                self._prepared.popitem(last = False)
+        return prepared.copy()
@@ -0,0 +1,167 @@
+###############################################################################
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+
+import contextlib
+import fcntl
+import hashlib
+import os
+import threading
+
+import yaml
+
+import utils
+
+
+_YAML_LOADER = yaml.SafeLoader
+_YAML_DUMPER = yaml.SafeDumper
+_LOCK_FILE_SUFFIX = '.lock'
+_FILE_MODE = 0600
+DEFAULT_EXPIRY_MARGIN = 60
+
+
+def cache_key(api_url, auth_data):
+    '''Builds a cache key out of the API URL and the eauth identity. -> str
+
+    Only the eauth backend and the user name take part in the key,
+    so no secrets are ever written to the cache file.
+    '''
+    identity = [str(api_url).rstrip('/')]
+    if auth_data:
+        identity.append(str(auth_data.get('eauth', '')))
+        identity.append(str(auth_data.get('username', '')))
+    return hashlib.sha1('\n'.join(identity)).hexdigest()
+
+
+class TokenCache(object):
+    '''An on-disk Salt API token cache shared between processes.
+
+    Tokens are stored in a single YAML file, guarded by an exclusive
+    `flock' on a companion lock file, so managers living in different
+    processes on the same host may safely share them.
+
+    Interesting methods:
+        * get - returns a cached token, if it is still valid,
+        * put - stores a token,
+        * discard - removes a token,
+        * locked - holds the lock over several of the above (e.g. to
+                log in only if no token is cached meanwhile).
+    '''
+
+    def __init__(self, path, expiry_margin = DEFAULT_EXPIRY_MARGIN):
+        '''Cache constructor. -> TokenCache
+
+        Arguments:
+            * path = a path to the cache file (it will be created
+                    if needed),
+            * expiry_margin = tokens expiring within this number
+                    of seconds are treated as already expired.
+        '''
+        self._path = os.path.expanduser(path)
+        self._lock_path = self._path + _LOCK_FILE_SUFFIX
+        self._expiry_margin = expiry_margin
+        # The number of `locked' blocks each thread is in.
+        self._depth = threading.local()
+
+    @contextlib.contextmanager
+    def locked(self):
+        '''Holds the lock for the duration of the block, blocking other
+        threads and processes using the cache. May be nested.
+        '''
+        depth = getattr(self._depth, 'value', 0)
+        if depth:
+            self._depth.value = depth + 1
+            try:
+                yield
+            finally:
+                self._depth.value = depth
+            return
+        with self._flocked():
+            self._depth.value = 1
+            try:
+                yield
+            finally:
+                self._depth.value = 0
+
+    @contextlib.contextmanager
+    def _flocked(self):
+        directory = os.path.dirname(self._path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, _FILE_MODE)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _load(self):
+        try:
+            with open(self._path, 'r') as f:
+                tokens = yaml.load(f.read(), Loader = _YAML_LOADER)
+        except (IOError, OSError, yaml.YAMLError):
+            return {}
+        if not isinstance(tokens, dict):
+            return {}
+        return tokens
+
+    def _save(self, tokens):
+        now_valid = dict(
+                (k, t) for k, t in tokens.iteritems()
+                if utils.token_valid(t))
+        tmp_path = '{0}.{1}'.format(self._path, os.getpid())
+        fd = os.open(
+                tmp_path,
+                os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                _FILE_MODE)
+        with os.fdopen(fd, 'w') as f:
+            f.write(yaml.dump(now_valid, Dumper = _YAML_DUMPER))
+        os.rename(tmp_path, self._path)
+
+    def get(self, key):
+        '''Returns a cached token or None. -> dict or None
+
+        Tokens which are not valid for at least `expiry_margin'
+        more seconds are not returned.
+        '''
+        with self.locked():
+            token = self._load().get(key)
+        if token is None or not utils.token_valid(
+                token, self._expiry_margin):
+            return None
+        return token
+
+    def put(self, key, token):
+        '''Stores the given token under the given key.'''
+        with self.locked():
+            tokens = self._load()
+            tokens[key] = token
+            self._save(tokens)
+
+    def discard(self, key, token = None):
+        '''Removes the token stored under the given key.
+
+        If `token' is given, the entry is removed only if it still
+        holds that very token (another process might have replaced it).
+        '''
+        with self.locked():
+            tokens = self._load()
+            cached = tokens.get(key)
+            if cached is None:
+                return
+            if token is not None and cached.get('token') != token['token']:
+                return
+            del tokens[key]
+            self._save(tokens)
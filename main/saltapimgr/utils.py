@@ -13,7 +13,9 @@
 ###############################################################################
 
 
+import json
 import time
+import zlib
 
 import requests
 
@@ -24,83 +26,316 @@ import log
 import manager
 
 
-_YAML_LOADER = yaml.SafeLoader
-_YAML_DUMPER = yaml.SafeDumper
+# The libyaml bindings are an order of magnitude faster than the pure
+# Python implementation, but they are optional.
+_YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+# Incremental parsing needs the composer API, which only the pure Python
+# loader exposes.
+_STREAM_YAML_LOADER = yaml.SafeLoader
+_STREAM_CONTENT_TYPE = 'application/x-yaml'
+_STREAM_CHUNK_SIZE = 64 * 1024
+_GLOB_CHARACTERS = '*?[],'
+# wbits selecting the gzip container.
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class Codec(object):
+    '''A wire format for requests and responses.
+
+    Interesting methods:
+        * dump - serialises a data structure,
+        * load - parses a serialised data structure.
+
+    Interesting properties:
+        * name - the codec name,
+        * content_type - the MIME type used for content negotiation.
+    '''
+
+    def __init__(self, name, content_type, dump, load):
+        self.name = name
+        self.content_type = content_type
+        self._dump = dump
+        self._load = load
+
+    def dump(self, data):
+        return self._dump(data)
+
+    def load(self, text):
+        return self._load(text)
+
+
+YAML = Codec(
+        'yaml',
+        'application/x-yaml',
+        lambda data: yaml.dump(data, Dumper = _YAML_DUMPER),
+        lambda text: yaml.load(text, Loader = _YAML_LOADER)
+    )
+JSON = Codec(
+        'json',
+        'application/json',
+        json.dumps,
+        json.loads
+    )
+CODECS = {
+        YAML.name: YAML,
+        JSON.name: JSON
+    }
+
+
+def get_codec(codec):
+    '''Returns a codec given either by name or by itself. -> Codec'''
+    if isinstance(codec, Codec):
+        return codec
+    return CODECS[codec]
+
+
+def _response_codec(response, codec):
+    # Parse whatever the server has actually sent, if it is known.
+    content_type = response.headers.get('Content-Type', '')
+    content_type = content_type.split(';')[0].strip()
+    for known in CODECS.itervalues():
+        if known.content_type == content_type:
+            return known
+    return codec
+
+
+def _wire_size(response, default):
+    # The number of body bytes received, before they have been decoded.
+    try:
+        return response.raw.tell()
+    except AttributeError:
+        return default
+
+
+def _load_response(response, codec, stats = None):
+    content = response.content
+    started = time.time()
+    result = _response_codec(response, codec).load(content)
+    if stats is not None:
+        stats['response_bytes'] = len(content)
+        stats['response_wire_bytes'] = _wire_size(response, len(content))
+        stats['parse_time'] = time.time() - started
+    return result
+
+
+def _compress_request(request, threshold):
+    # Compresses the body of a prepared request with gzip, if it has
+    # at least `threshold' bytes. -> the original body size
+    size = len(request.body) if request.body else 0
+    if threshold is None or size == 0 or size < threshold:
+        return size
+    compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION,
+            zlib.DEFLATED,
+            _GZIP_WBITS
+        )
+    request.body = compressor.compress(request.body) + compressor.flush()
+    request.headers['Content-Encoding'] = 'gzip'
+    request.headers['Content-Length'] = str(len(request.body))
+    return size
+
+
+def _record_request(stats, request, size = None):
+    if stats is not None:
+        wire_size = len(request.body) if request.body else 0
+        stats['request_bytes'] = wire_size if size is None else size
+        stats['request_wire_bytes'] = wire_size
 
 
 def _log_http_request(logger, level, prefix, request):
     log.log(
             logger,
             level,
-            '{0}: sending {1}, headers = {2}, body = \'{3}\''.format(
-                    prefix,
-                    str(request).strip(),
-                    str(request.headers).strip(),
-                    str(request.body).strip()
-                )
+            '{0}: sending {1}, headers = {2}, body = \'{3}\'',
+            prefix,
+            request,
+            request.headers,
+            request.body
         )
 
 
-def token_valid(token):
+def token_valid(token, margin = 0):
     now = time.time()
-    return now >= token['start'] and now < token['expire']
+    return now >= token['start'] and now + margin < token['expire']
 
 
-def send_login_request(session, base_url, auth_data, logger):
-    data_as_yaml = yaml.dump(
-            auth_data,
-            Dumper = _YAML_DUMPER
-        )
+def send_login_request(
+        session,
+        base_url,
+        auth_data,
+        logger,
+        codec = YAML,
+        timeout = None,
+        stats = None):
     request = requests.Request(
             method = 'POST',
             url = base_url + '/login',
-            data = data_as_yaml,
+            data = codec.dump(auth_data),
             headers = {
-                    'Accept': 'application/x-yaml',
-                    'Content-Type': 'application/x-yaml'
+                    'Accept': codec.content_type,
+                    'Content-Type': codec.content_type
                 }
         )
-    prepared_request = request.prepare()
+    prepared_request = session.prepare_request(request)
     _log_http_request(logger, 'debug', 'login', prepared_request)
-    response = session.send(prepared_request)
+    _record_request(stats, prepared_request)
+    response = session.send(prepared_request, timeout = timeout)
     result = None
     if response.ok:
-        result_raw = yaml.load(
-                response.text,
-                Loader = _YAML_LOADER
-            )
+        result_raw = _load_response(response, codec, stats)
         result = result_raw['return'][0]
     return response, result
 
 
-def send_logout_request(session, base_url, token, logger):
-    data_as_yaml = yaml.dump(
-            token,
-            Dumper = _YAML_DUMPER
-        )
+def send_logout_request(
+        session,
+        base_url,
+        token,
+        logger,
+        codec = YAML,
+        timeout = None,
+        stats = None):
     request = requests.Request(
             method = 'POST',
             url = base_url + '/logout',
-            data = data_as_yaml,
+            data = codec.dump(token),
             headers = {
-                    'Accept': 'application/x-yaml',
-                    'Content-Type': 'application/x-yaml',
+                    'Accept': codec.content_type,
+                    'Content-Type': codec.content_type,
                     'X-Auth-Token': token['token']
                 }
         )
-    prepared_request = request.prepare()
+    prepared_request = session.prepare_request(request)
     _log_http_request(logger, 'debug', 'logout', prepared_request)
-    response = session.send(prepared_request)
+    _record_request(stats, prepared_request)
+    response = session.send(prepared_request, timeout = timeout)
     result = None
     if response.ok:
-        result_raw = yaml.load(
-                response.text,
-                Loader = _YAML_LOADER
-            )
+        result_raw = _load_response(response, codec, stats)
         result = result_raw['return']
     return response, result
 
 
+def send_job_request(
+        session,
+        base_url,
+        token,
+        jid,
+        logger,
+        codec = YAML,
+        timeout = None,
+        stats = None):
+    headers = {
+            'Accept': codec.content_type,
+        }
+    if token:
+        headers['X-Auth-Token'] = token['token']
+    request = requests.Request(
+            method = 'GET',
+            url = '{0}/jobs/{1}'.format(base_url, jid),
+            headers = headers
+        )
+    prepared_request = session.prepare_request(request)
+    _log_http_request(logger, 'debug', 'job', prepared_request)
+    _record_request(stats, prepared_request)
+    response = session.send(prepared_request, timeout = timeout)
+    result = None
+    if response.ok:
+        result_raw = _load_response(response, codec, stats)
+        info = result_raw.get('info') or [{}]
+        returns = result_raw.get('return') or [{}]
+        result = {'info': info[0], 'return': returns[0]}
+    return response, result
+
+
+def open_event_stream(session, base_url, token, logger, timeout, stats = None):
+    headers = {
+            'Accept': 'text/event-stream',
+            # Compressing proxies would buffer the stream.
+            'Accept-Encoding': 'identity'
+        }
+    if token:
+        headers['X-Auth-Token'] = token['token']
+    request = requests.Request(
+            method = 'GET',
+            url = base_url + '/events',
+            headers = headers
+        )
+    prepared_request = session.prepare_request(request)
+    _log_http_request(logger, 'debug', 'events', prepared_request)
+    _record_request(stats, prepared_request)
+    return session.send(prepared_request, stream = True, timeout = timeout)
+
+
+def iter_events(response):
+    # Server-sent events: `field: value' lines, separated by empty lines.
+    tag = None
+    data = []
+    for line in response.iter_lines(chunk_size = 1):
+        if not line:
+            if data:
+                try:
+                    event = json.loads('\n'.join(data))
+                except ValueError:
+                    event = None
+                if isinstance(event, dict):
+                    yield event.get('tag', tag), event.get('data')
+            tag = None
+            data = []
+            continue
+        field, _, value = line.partition(':')
+        value = value[1:] if value.startswith(' ') else value
+        if field == 'tag':
+            tag = value
+        elif field == 'data':
+            data.append(value)
+
+
+def function_name(command):
+    try:
+        return command.get('fun')
+    except AttributeError:
+        return None
+
+
+def command_target(command):
+    # -> (target, target type) or (None, None) if unknown
+    try:
+        return (
+                command.get('tgt'),
+                command.get('tgt_type', command.get('expr_form'))
+            )
+    except AttributeError:
+        return None, None
+
+
+def set_target_type(command, tgt_type):
+    '''Sets the command's target type, understood by any master.'''
+    command['tgt_type'] = tgt_type
+    # Masters older than 2017.7 only know `expr_form'.
+    command['expr_form'] = tgt_type
+
+
+def explicit_minions(target, tgt_type = None):
+    '''Returns the ids of minions matched by the target, if they can be
+    told without asking the master. -> frozenset or None
+    '''
+    if tgt_type in (None, 'glob'):
+        if (isinstance(target, basestring) and target
+                and not any(c in target for c in _GLOB_CHARACTERS)):
+            return frozenset([target])
+        return None
+    if tgt_type == 'list':
+        if isinstance(target, basestring):
+            target = target.split(',')
+        try:
+            return frozenset(target)
+        except TypeError:
+            return None
+    return None
+
+
 def command_translation(command):
     if not command:
         raise exceptions.InvalidArgument(exceptions.NO_COMMAND_SPECIFIED)
@@ -109,53 +344,245 @@ def command_translation(command):
     return command
 
 
-def collection_translation(commands, logger, use_yaml):
+def collection_translation(commands, logger, codec):
     if not commands:
         raise exceptions.InvalidArgument(
                 exceptions.EMPTY_COMMAND_LIST_SPECIFIED)
     command_list = [command_translation(c) for c in commands]
     log.debug(
             logger,
-            'translation: translated to \'{0}\''.format(
-                    str(command_list).strip()
-                )
+            'translation: translated to \'{0}\'',
+            command_list
         )
-    if use_yaml:
-        command_list = yaml.dump(command_list, Dumper = _YAML_DUMPER)
+    if codec is not None:
+        command_list = codec.dump(command_list)
     return command_list
 
 
-def send_command_request(
+def _prepare_command_request(
         session,
         base_url,
         token,
         commands,
-        single,
-        logger,
-        yaml_format):
+        codec,
+        serialised,
+        accept):
     headers = {
-            'Accept': 'application/x-yaml',
+            'Accept': accept,
         }
     if token:
         headers['X-Auth-Token'] = token['token']
-    if yaml_format:
-        headers['Content-Type'] = 'application/x-yaml'
+    if serialised:
+        headers['Content-Type'] = codec.content_type
     request = requests.Request(
             method = 'POST',
             url = base_url,
             headers = headers,
             data = commands
         )
-    prepared_request = request.prepare()
+    return session.prepare_request(request)
+
+
+def send_command_request(
+        session,
+        base_url,
+        token,
+        commands,
+        single,
+        logger,
+        codec,
+        serialised = True,
+        timeout = None,
+        stats = None,
+        compress_threshold = None):
+    prepared_request = _prepare_command_request(
+            session,
+            base_url,
+            token,
+            commands,
+            codec,
+            serialised,
+            codec.content_type
+        )
+    return send_prepared_command_request(
+            session,
+            prepared_request,
+            single,
+            logger,
+            codec,
+            timeout,
+            stats,
+            compress_threshold
+        )
+
+
+def send_prepared_command_request(
+        session,
+        prepared_request,
+        single,
+        logger,
+        codec,
+        timeout = None,
+        stats = None,
+        compress_threshold = None):
     _log_http_request(logger, 'debug', 'send', prepared_request)
-    response = session.send(prepared_request)
+    size = _compress_request(prepared_request, compress_threshold)
+    _record_request(stats, prepared_request, size)
+    response = session.send(prepared_request, timeout = timeout)
     result = None
     if response.ok:
-        result_raw = yaml.load(
-                response.text,
-                Loader = _YAML_LOADER
-            )
+        result_raw = _load_response(response, codec, stats)
         result = result_raw['return']
         if single:
             result = result[0]
     return response, result
+
+
+class _BoundedReader(object):
+    # A file-like view of a streamed response body, which refuses to read
+    # more than `max_size' bytes.
+
+    def __init__(self, response, max_size):
+        self._chunks = response.iter_content(chunk_size = _STREAM_CHUNK_SIZE)
+        self._buffer = ''
+        self._max_size = max_size
+        self.size = 0
+
+    def read(self, size = -1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                break
+            self.size += len(chunk)
+            if self._max_size is not None and self.size > self._max_size:
+                raise exceptions.InvalidResponse(
+                        exceptions.RESPONSE_TOO_LARGE)
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _expect_event(loader, event_class):
+    if not loader.check_event(event_class):
+        raise exceptions.InvalidResponse(exceptions.MALFORMED_RESPONSE)
+    return loader.get_event()
+
+
+def _construct_next(loader):
+    node = loader.compose_node(None, None)
+    return loader.construct_document(node)
+
+
+def _iter_minion_results(loader, index, per_state):
+    _expect_event(loader, yaml.MappingStartEvent)
+    while not loader.check_event(yaml.MappingEndEvent):
+        minion = _construct_next(loader)
+        if per_state and loader.check_event(yaml.MappingStartEvent):
+            loader.get_event()
+            while not loader.check_event(yaml.MappingEndEvent):
+                state = _construct_next(loader)
+                yield index, minion, state, _construct_next(loader)
+            loader.get_event()
+        elif per_state:
+            yield index, minion, None, _construct_next(loader)
+        else:
+            yield index, minion, _construct_next(loader)
+    loader.get_event()
+
+
+def iter_results(stream, per_state = False):
+    '''Incrementally parses a `{return: [...]}' document.
+
+    Yields (command index, minion, result) tuples or, if `per_state' is
+    set, (command index, minion, state, result) tuples, holding only one
+    of them in memory at a time. Results which are not per-minion
+    mappings are yielded with a None minion (and state).
+    '''
+    loader = _STREAM_YAML_LOADER(stream)
+    loader.anchors = {}
+    try:
+        _expect_event(loader, yaml.StreamStartEvent)
+        _expect_event(loader, yaml.DocumentStartEvent)
+        _expect_event(loader, yaml.MappingStartEvent)
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = _construct_next(loader)
+            if key != 'return':
+                _construct_next(loader)
+                continue
+            _expect_event(loader, yaml.SequenceStartEvent)
+            index = 0
+            while not loader.check_event(yaml.SequenceEndEvent):
+                if loader.check_event(yaml.MappingStartEvent):
+                    for r in _iter_minion_results(loader, index, per_state):
+                        yield r
+                elif per_state:
+                    yield index, None, None, _construct_next(loader)
+                else:
+                    yield index, None, _construct_next(loader)
+                index += 1
+            loader.get_event()
+    except yaml.YAMLError:
+        raise exceptions.InvalidResponse(exceptions.MALFORMED_RESPONSE)
+    finally:
+        loader.dispose()
+
+
+def send_streamed_command_request(
+        session,
+        base_url,
+        token,
+        commands,
+        logger,
+        codec,
+        serialised = True,
+        max_size = None,
+        per_state = False,
+        timeout = None,
+        stats = None,
+        compress_threshold = None):
+    # JSON has no incremental parser in the standard library, so streamed
+    # responses are always requested (and parsed) as YAML.
+    prepared_request = _prepare_command_request(
+            session,
+            base_url,
+            token,
+            commands,
+            codec,
+            serialised,
+            _STREAM_CONTENT_TYPE
+        )
+    _log_http_request(logger, 'debug', 'send streamed', prepared_request)
+    size = _compress_request(prepared_request, compress_threshold)
+    _record_request(stats, prepared_request, size)
+    response = session.send(
+            prepared_request,
+            stream = True,
+            timeout = timeout
+        )
+    if not response.ok:
+        response.close()
+        return response, None
+    length = response.headers.get('Content-Length')
+    if stats is not None and length:
+        # The decoded size is not known until the body has been read.
+        stats['response_wire_bytes'] = int(length)
+        if 'Content-Encoding' not in response.headers:
+            stats['response_bytes'] = int(length)
+    if max_size is not None and length and int(length) > max_size:
+        response.close()
+        raise exceptions.InvalidResponse(exceptions.RESPONSE_TOO_LARGE)
+
+    def results():
+        try:
+            for r in iter_results(
+                    _BoundedReader(response, max_size),
+                    per_state):
+                yield r
+        finally:
+            response.close()
+
+    return response, results()
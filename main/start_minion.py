@@ -13,6 +13,9 @@
 ###############################################################################
 
 
+import contextlib
+import multiprocessing.pool
+import requests
 import subprocess
 import time
 import yaml
@@ -22,21 +25,59 @@ from cloudify.decorators import operation
 from cloudify.exceptions import NonRecoverableError
 from cloudify.exceptions import RecoverableError
 
+import master_ssh
+import minion_probe
 import saltapimgr
 from validation import validate_context
 
 
+_DEFAULT_HIGHSTATE_TIMEOUT = 3600
+_MINION_READY_TIMEOUT = 30
+_KEY_ACCEPTANCE_TIMEOUT = 20
+_API_KEY_ACCEPTANCE = 'api'
+_SSH_KEY_ACCEPTANCE = 'ssh'
+
+
 def _start_service():
     ctx.logger.info('Starting salt minion')
-    subprocess.call(['sudo', 'service', 'salt-minion', 'start'])
+    returncode = subprocess.call(['sudo', 'service', 'salt-minion', 'start'])
+    if returncode != 0:
+        # E.g. upstart fails to start a job which is already running.
+        ctx.logger.warn(
+            'Starting salt minion exited with return code '
+            '{0}.'.format(returncode)
+        )
+
+
+def _probe_minion(minion_id):
+    ctx.logger.info(
+        'Waiting for minion {0} to connect to the master...'.format(minion_id)
+    )
+    unmet = minion_probe.wait_until_ready(
+        ctx.node.properties.get('minion_config', None),
+        timeout=_MINION_READY_TIMEOUT
+    )
+    if minion_probe.PROCESS in unmet:
+        raise RecoverableError(
+            'Minion {0} is not running.'.format(minion_id)
+        )
+    if unmet:
+        ctx.logger.warn(
+            'Minion {0} has not met local readiness conditions within '
+            '{1} seconds: {2}.'.format(
+                minion_id, _MINION_READY_TIMEOUT, ', '.join(unmet))
+        )
 
 
-def _authorize_minion(minion_id):
+def _authorize_minion_over_ssh(minion_id):
     def get_auth_command(minion_id):
         key_file = ctx.node.properties['master_private_ssh_key']
         user = ctx.node.properties['master_ssh_user']
         host = ctx.node.properties['minion_config']['master']
-        target = '{0}@{1}'.format(user, host)
+        control_persist = ctx.node.properties.get(
+            'master_ssh_control_persist', None)
+        if control_persist is None or control_persist == '':
+            control_persist = master_ssh.DEFAULT_CONTROL_PERSIST
 
         accept_minion_loop = """
         for i in `seq 1 10`; do
@@ -49,14 +90,13 @@ def _authorize_minion(minion_id):
         if [ $? -eq 0 ]; then exit 0; else exit 254; fi
         """.format(minion_id)
 
-        return [
-            'ssh',
-            '-i', key_file,
-            '-oStrictHostKeyChecking=no',
-            '-oUserKnownHostsFile=/dev/null',
-            target,
-            accept_minion_loop
-        ]
+        return master_ssh.command(
+            user,
+            host,
+            key_file,
+            accept_minion_loop,
+            control_persist=control_persist
+        )
 
     ctx.logger.info('Authorizing {0}...'.format(minion_id))
     try:
@@ -85,12 +125,63 @@ def _authorize_minion(minion_id):
         ctx.logger.info('{0} authorization successful.'.format(minion_id))
 
 
-def _instantiate_manager():
+def _authorize_minion(minion_id, mgr, login):
+    acceptance = ctx.node.properties.get('minion_key_acceptance', None)
+    if not acceptance:
+        acceptance = _API_KEY_ACCEPTANCE
+    if acceptance == _SSH_KEY_ACCEPTANCE:
+        _authorize_minion_over_ssh(minion_id)
+        return
+
+    ctx.logger.info('Authorizing {0} through Salt API...'.format(minion_id))
+    try:
+        _wait_for_log_in(login)
+        accepted = mgr.authorize_minion(
+            minion_id,
+            timeout=_KEY_ACCEPTANCE_TIMEOUT
+        )
+    except (saltapimgr.exceptions.CallFailed,
+            requests.exceptions.RequestException) as e:
+        ctx.logger.warn(
+            'Unable to manage minion keys through Salt API ({0}), '
+            'falling back to SSH.'.format(e)
+        )
+        _authorize_minion_over_ssh(minion_id)
+        return
+    if not accepted:
+        raise NonRecoverableError(
+            'Minion {0} did not report to Salt master '
+            'and cannot be authorized.'.format(minion_id)
+        )
+    ctx.logger.info('{0} authorization successful.'.format(minion_id))
+
+
+@contextlib.contextmanager
+def _phase(timings, name):
+    started = time.time()
+    try:
+        yield
+    finally:
+        elapsed = time.time() - started
+        timings[name] = round(elapsed, 3)
+        saltapimgr.metrics.REGISTRY.observe_phase(name, elapsed)
+
+
+def _instantiate_manager(metrics):
     api_url = ctx.node.properties['salt_api_url']
     auth_data = ctx.node.properties.get('salt_api_auth_data', None)
     token = ctx.node.properties.get('token', None)
     session_options = ctx.node.properties.get('session_options', None)
     logger_injection = ctx.node.properties.get('logger_injection', None)
+    token_cache_path = ctx.node.properties.get('salt_api_token_cache', None)
+    pool_size = ctx.node.properties.get('salt_api_pool_size', None)
+    keep_alive = ctx.node.properties.get('salt_api_keep_alive', True)
+    codec = ctx.node.properties.get('salt_api_codec', None)
+    retries = ctx.node.properties.get('salt_api_retries', None)
+    coalesce_window = ctx.node.properties.get(
+        'salt_api_coalesce_window', None)
+    result_cache = ctx.node.properties.get('salt_api_result_cache', None)
+    compression = ctx.node.properties.get('salt_api_compression', None)
 
     # UGH. we want to use 'None' default values inside yaml, but we cannot,
     # so we have to use empty strings there and convert them here.
@@ -102,16 +193,63 @@ def _instantiate_manager():
         session_options = None
     if not logger_injection:
         logger_injection = None
+    if not token_cache_path:
+        token_cache_path = None
+    if not pool_size:
+        pool_size = saltapimgr.sessions.DEFAULT_POOL_SIZE
+    if not codec:
+        codec = saltapimgr.utils.YAML
+    if not retries:
+        retries = {}
+    if not result_cache:
+        result_cache = None
+    if not compression:
+        compression = {}
     # END UGH.
 
     if logger_injection is not None:
         injected_logger = ctx.logger
         injected_logger_level = logger_injection.get('level', None)
         injected_logger_show_auth = logger_injection.get('show_auth', None)
+        injected_logger_payload_limit = logger_injection.get(
+            'payload_limit', saltapimgr.log.DEFAULT_PAYLOAD_LIMIT)
     else:
         injected_logger = None
         injected_logger_level = None
         injected_logger_show_auth = None
+        injected_logger_payload_limit = saltapimgr.log.DEFAULT_PAYLOAD_LIMIT
+
+    if token_cache_path is not None:
+        token_cache = saltapimgr.TokenCache(token_cache_path)
+    else:
+        token_cache = None
+
+    # Writes are retried only if listed explicitly.
+    idempotent_functions = saltapimgr.retry.DEFAULT_IDEMPOTENT_FUNCTIONS.union(
+        retries.get('retry_functions', []))
+    retry_policy = saltapimgr.retry.RetryPolicy(
+        max_attempts=retries.get(
+            'max_attempts', saltapimgr.retry.DEFAULT_MAX_ATTEMPTS),
+        base_delay=retries.get(
+            'base_delay', saltapimgr.retry.DEFAULT_BASE_DELAY),
+        max_delay=retries.get(
+            'max_delay', saltapimgr.retry.DEFAULT_MAX_DELAY),
+        deadline=retries.get('deadline', None),
+        idempotent_functions=idempotent_functions,
+        retry_non_idempotent=retries.get('retry_non_idempotent', False)
+    )
+
+    if coalesce_window:
+        coalescer = saltapimgr.coalesce.get_coalescer(coalesce_window)
+    else:
+        coalescer = None
+
+    if result_cache is not None:
+        result_cache = saltapimgr.cache.ResultCache(
+            ttl=result_cache.get('ttl', saltapimgr.cache.DEFAULT_TTL),
+            max_entries=result_cache.get(
+                'max_entries', saltapimgr.cache.DEFAULT_MAX_ENTRIES)
+        )
 
     return saltapimgr.SaltRESTManager(
         api_url,
@@ -120,64 +258,92 @@ def _instantiate_manager():
         session_options=session_options,
         root_logger=injected_logger,
         log_level=injected_logger_level,
-        show_auth_data=injected_logger_show_auth
+        log_payload_limit=injected_logger_payload_limit,
+        show_auth_data=injected_logger_show_auth,
+        token_cache=token_cache,
+        pool_size=pool_size,
+        keep_alive=keep_alive,
+        codec=codec,
+        retry_policy=retry_policy,
+        metrics=metrics,
+        coalescer=coalescer,
+        result_cache=result_cache,
+        compress_responses=compression.get('responses', True),
+        compress_threshold=compression.get('request_threshold', None)
     )
 
 
+def _release_manager(mgr):
+    # A cached token is shared with other operations on this host,
+    # so it is left to expire instead of being invalidated.
+    if mgr.token_cache is not None:
+        ctx.logger.debug('Keeping cached token for further operations')
+        return
+    resp, result = mgr.log_out()
+    if resp.ok:
+        ctx.logger.debug('Token has been cleared')
+    else:
+        ctx.logger.warn('Unable to clear token.')
+
+
+def _log_in(mgr, timings):
+    # Runs in the background, so it must not use `ctx' (which is
+    # thread-local). The connection it opens is then reused.
+    with _phase(timings, 'log_in'):
+        return mgr.log_in()
+
+
+def _wait_for_log_in(login):
+    resp, result = login.get()
+    if not result:
+        ctx.logger.error('Got response {0}'.format(resp))
+        raise NonRecoverableError('Unable to connect with Salt API.')
+
+
+def _wait_for_minion(minion_id, mgr, login):
+    _wait_for_log_in(login)
+    ctx.logger.info('Connected to Salt API.')
+    ctx.logger.info('Waiting for minion {0}...'.format(minion_id))
+    if not mgr.wait_for_minion(minion_id, timeout=_MINION_READY_TIMEOUT):
+        raise RecoverableError('{0} does not respond.'.format(minion_id))
+
+
 # Conceptually this belongs to configuration, but since we are using
 # Salt API to add grains to minions, we need to do start and authorize
 # minion first.
-def _append_grains(minion_id):
-    # grains = a list of pairs
-    grains = ctx.node.properties.get('grains', [])
-    if grains:
-        mgr = _instantiate_manager()
-        mgr.log_in()
-        mgr.ping(minion_id)
+def _append_grains(minion_id, mgr, pairs):
+    if pairs:
+        response, result = mgr.apply_grains(minion_id, pairs)
         added_grains = []
-        for i in grains:
-            grain = i.keys()[0]
-            value = i.values()[0]
-            response, result = mgr.append_grain(minion_id, grain, value)
-            if response.ok:
-                added_grains.append((grain, value))
-        ctx.logger.info('Using additional grains: {0}.'.format(str(added_grains)))
-        response, result = mgr.list_grains(minion_id)
         all_grains = []
         if response.ok:
-            all_grains = result[minion_id]
+            added_grains = [
+                (grain, value)
+                for grain, value, succeeded in result['applied']
+                if succeeded
+            ]
+            all_grains = result['grains'].get(minion_id, [])
+        else:
+            ctx.logger.error('Got response {0}'.format(response))
+        ctx.logger.info('Using additional grains: {0}.'.format(str(added_grains)))
         # TODO: Turn the following into some sort of debug.
         ctx.logger.info('A complete collection of currently used grains grains: {0}.'.format(str(all_grains)))
-        resp, result = mgr.log_out()
-        if resp.ok:
-            ctx.logger.info('Token has been cleared')
-        else:
-            ctx.logger.error('Unable to clear token.')
-
-
-def _execute_initial_state(minion_id):
-    mgr = _instantiate_manager()
-
-    ctx.logger.info('Connecting to Salt API...')
-    resp, result = mgr.log_in()
-    if not resp.ok:
-        ctx.logger.error('Got response {0}'.format(resp))
-        raise NonRecoverableError('Unable to connect with Salt API.')
-    ctx.logger.info('Connected to Salt API.')
 
-    ctx.logger.info('Pinging minion {0}...'.format(minion_id))
-    for i in xrange(15):
-        time.sleep(2)
-        resp, result = mgr.ping(minion_id)
-        if resp.ok and minion_id in result:
-            break
-    else:
-        raise RecoverableError('{0} does not respond.'.format(minion_id))
 
+def _execute_initial_state(minion_id, mgr):
     ctx.logger.info(
         'Executing highstate on minion {0}...'.format(minion_id)
     )
-    resp, result = mgr.highstate(minion_id)
+    timeout = ctx.node.properties.get('highstate_timeout', None)
+    if not timeout:
+        timeout = _DEFAULT_HIGHSTATE_TIMEOUT
+    try:
+        resp, result = mgr.highstate_async(minion_id, timeout=timeout)
+    except saltapimgr.exceptions.TimedOut:
+        raise NonRecoverableError(
+            'Highstate on minion {0} has not finished within {1} '
+            'seconds.'.format(minion_id, timeout)
+        )
     if not resp.ok:
         ctx.logger.error('Got response {0}'.format(resp))
         raise NonRecoverableError(
@@ -185,19 +351,59 @@ def _execute_initial_state(minion_id):
         )
     ctx.logger.info('Executed highstate on minion {0}.'.format(minion_id))
 
-    resp, result = mgr.log_out()
-    if resp.ok:
-        ctx.logger.debug('Token has been cleared')
-    else:
-        ctx.logger.warn('Unable to clear token.')
+
+def _report_timings(timings, metrics):
+    ctx.logger.info('Phase timings: {0}.'.format(timings))
+    ctx.instance.runtime_properties['phase_timings'] = timings
+    ctx.instance.runtime_properties['salt_api_calls'] = metrics.summary()
+    textfile = ctx.node.properties.get('metrics_textfile', None)
+    if textfile:
+        try:
+            saltapimgr.metrics.write_prometheus_textfile(
+                saltapimgr.metrics.REGISTRY,
+                textfile
+            )
+        except (IOError, OSError) as e:
+            ctx.logger.warn(
+                'Unable to write metrics to {0}: {1}'.format(textfile, e)
+            )
 
 
 @operation
 def run(*args, **kwargs):
     validate_context(ctx.node.properties)
     minion_id = ctx.instance.runtime_properties['minion_id']
-    _start_service()
-    _authorize_minion(minion_id)
-    # note that highstate may depend on grains.
-    _append_grains(minion_id)
-    _execute_initial_state(minion_id)
+    # grains = a list of pairs
+    grains = ctx.node.properties.get('grains', [])
+    pairs = [(i.keys()[0], i.values()[0]) for i in grains]
+    # Salt API calls of this operation are also accounted process-wide.
+    metrics = saltapimgr.metrics.MetricsRegistry()
+    metrics.add_hook(saltapimgr.metrics.REGISTRY.record)
+    timings = {}
+    started = time.time()
+    mgr = _instantiate_manager(metrics)
+    # Logging in does not depend on the minion, so it is done while
+    # the service is being started (and its key accepted over SSH).
+    pool = multiprocessing.pool.ThreadPool(1)
+    try:
+        ctx.logger.info('Connecting to Salt API...')
+        login = pool.apply_async(_log_in, (mgr, timings))
+        with _phase(timings, 'start_service'):
+            _start_service()
+        with _phase(timings, 'authorize_minion'):
+            _authorize_minion(minion_id, mgr, login)
+        with _phase(timings, 'probe_minion'):
+            _probe_minion(minion_id)
+        with _phase(timings, 'wait_for_minion'):
+            _wait_for_minion(minion_id, mgr, login)
+        # note that highstate may depend on grains.
+        with _phase(timings, 'append_grains'):
+            _append_grains(minion_id, mgr, pairs)
+        with _phase(timings, 'execute_initial_state'):
+            _execute_initial_state(minion_id, mgr)
+        _release_manager(mgr)
+    finally:
+        pool.close()
+        pool.join()
+        timings['total'] = round(time.time() - started, 3)
+        _report_timings(timings, metrics)
@@ -16,8 +16,59 @@
 ###############################################################################
 
 
+# SALT_MINION_PACKAGES - if set, a space separated list of paths to pinned
+# (and already verified) packages which are installed instead of the latest
+# ones from the Salt repositories.
+
+
+# Exits unless the pinned salt-minion package has been installed (a failed
+# dependency resolution may have removed it again).
+check_pinned_deb() {
+    for package in ${SALT_MINION_PACKAGES}; do
+        [ "`dpkg-deb --field "${package}" Package`" = salt-minion ] || continue
+        expected="`dpkg-deb --field "${package}" Version`"
+        installed="`dpkg-query --show --showformat='${Status} ${Version}' \
+                salt-minion 2>/dev/null`"
+        [ "${installed}" = "install ok installed ${expected}" ] && return
+        echo "salt-minion ${expected} has not been installed" \
+                "(found: ${installed:-none})." 1>&2
+        exit 1
+    done
+    echo 'There is no salt-minion package among the pinned ones.' 1>&2
+    exit 1
+}
+
+
+check_pinned_rpm() {
+    format='%{VERSION}-%{RELEASE}'
+    for package in ${SALT_MINION_PACKAGES}; do
+        name="`rpm --query --package --queryformat '%{NAME}' "${package}"`"
+        [ "${name}" = salt-minion ] || continue
+        expected="`rpm --query --package --queryformat "${format}" \
+                "${package}"`"
+        installed="`rpm --query --queryformat "${format}" salt-minion`" \
+                || installed=
+        [ "${installed}" = "${expected}" ] && return
+        echo "salt-minion ${expected} has not been installed" \
+                "(found: ${installed:-none})." 1>&2
+        exit 1
+    done
+    echo 'There is no salt-minion package among the pinned ones.' 1>&2
+    exit 1
+}
+
+
 ubuntu_installation() {
 
+    [ -n "${SALT_MINION_PACKAGES}" ] && {
+        # dependencies missing from the list are taken from the OS mirror
+        sudo dpkg --install ${SALT_MINION_PACKAGES} \
+                || sudo apt-get --yes --fix-broken install || exit 1
+        check_pinned_deb
+        sudo service salt-minion stop || true
+        return
+    }
+
     # for some reason, default cloudify box has broken and missing packages
     sudo apt-get --yes --fix-broken --fix-missing install || exit 1
 
@@ -41,6 +92,15 @@ ubuntu_installation() {
 
 centos_or_redhat_installation() {
 
+    [ -n "${SALT_MINION_PACKAGES}" ] && {
+        sudo yum --verbose --assumeyes localinstall ${SALT_MINION_PACKAGES} \
+                || exit 1
+        check_pinned_rpm
+        sudo service salt-minion stop || true
+        sudo chmod 644 /etc/salt/minion || true
+        return
+    }
+
     link=http://ftp.linux.ncsu.edu/pub/epel/6/i386/epel-release-6-8.noarch.rpm
     sudo rpm --verbose --upgrade "${link}"
     sudo yum --verbose --assumeyes install salt-minion
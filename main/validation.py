@@ -13,8 +13,12 @@
 ###############################################################################
 
 
+import re
+
 from cloudify.exceptions import NonRecoverableError
 
+import saltapimgr
+
 
 def validate_context(context):
 
@@ -50,10 +54,23 @@ def validate_context(context):
         context, 'properties',
         required={'master_ssh_user': basestring,
                   'master_private_ssh_key': basestring,
-                  'salt_api_url': basestring},
+                  'salt_api_url': (basestring, list)},
         optional={'minion_config': dict,
                   'salt_api_auth_data': dict,
-                  'logger_injection': (basestring, dict)}
+                  'logger_injection': (basestring, dict),
+                  'salt_api_token_cache': basestring,
+                  'salt_api_pool_size': int,
+                  'salt_api_keep_alive': bool,
+                  'salt_api_codec': basestring,
+                  'salt_api_retries': (basestring, dict),
+                  'salt_api_coalesce_window': (int, float),
+                  'salt_api_result_cache': (basestring, dict),
+                  'salt_api_compression': (basestring, dict),
+                  'minion_packages': (basestring, dict),
+                  'master_ssh_control_persist': int,
+                  'minion_key_acceptance': basestring,
+                  'highstate_timeout': (int, float),
+                  'metrics_textfile': basestring}
     )
 
     if context.get('salt_api_auth_data', '') != '':
@@ -62,9 +79,68 @@ def validate_context(context):
             required={'eauth': basestring}
         )
 
+    if context.get('salt_api_codec', ''):
+        if context['salt_api_codec'] not in saltapimgr.utils.CODECS:
+            raise NonRecoverableError(
+                'Invalid configuration: "salt_api_codec" should be one of: '
+                '{0}'.format(','.join(sorted(saltapimgr.utils.CODECS)))
+            )
+
+    if context.get('minion_key_acceptance', '') not in ('', 'api', 'ssh'):
+        raise NonRecoverableError(
+            'Invalid configuration: "minion_key_acceptance" should be '
+            'either "api" or "ssh"'
+        )
+
+    if context.get('minion_packages', '') != '':
+        check_dict(
+            context['minion_packages'], 'minion_packages',
+            required={'packages': list},
+            optional={'source': basestring,
+                      'cache_dir': basestring}
+        )
+        for package in context['minion_packages']['packages']:
+            check_dict(
+                package, 'minion_packages.packages',
+                required={'name': basestring,
+                          'sha256': basestring}
+            )
+            if (not re.match(r'^[0-9a-fA-F]{64}$', package['sha256'])
+                    or not re.match(r'^[^/\s]+$', package['name'])):
+                raise NonRecoverableError(
+                    'Invalid configuration: "minion_packages" should '
+                    'list file names with their SHA-256 checksums'
+                )
+
+    if context.get('salt_api_retries', '') != '':
+        check_dict(
+            context['salt_api_retries'], 'salt_api_retries',
+            optional={'max_attempts': int,
+                      'base_delay': (int, float),
+                      'max_delay': (int, float),
+                      'deadline': (int, float),
+                      'retry_functions': list,
+                      'retry_non_idempotent': bool}
+        )
+
+    if context.get('salt_api_result_cache', '') != '':
+        check_dict(
+            context['salt_api_result_cache'], 'salt_api_result_cache',
+            optional={'ttl': (int, float),
+                      'max_entries': int}
+        )
+
+    if context.get('salt_api_compression', '') != '':
+        check_dict(
+            context['salt_api_compression'], 'salt_api_compression',
+            optional={'responses': bool,
+                      'request_threshold': int}
+        )
+
     if context.get('logger_injection', '') != '':
         check_dict(
             context['logger_injection'], 'logger_injection',
             optional={'level': basestring,
-                      'show_auth': basestring}
+                      'show_auth': basestring,
+                      'payload_limit': int}
         )
@@ -0,0 +1,374 @@
+###############################################################################
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+
+'''An in-process stand-in for Salt's REST API (rest_cherrypy).
+
+Implements just enough of `/login', `/logout', `/' (lowstate),
+`/jobs/<jid>' and `/events' for exercising `saltapimgr' without a Salt
+master. Latency, result sizes and job durations are configurable.
+Used by the tests and the benchmarks.
+'''
+
+
+import BaseHTTPServer
+import SocketServer
+import fnmatch
+import itertools
+import json
+import threading
+import time
+import uuid
+import zlib
+
+import yaml
+
+
+_YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+_JSON = 'application/json'
+_YAML = 'application/x-yaml'
+_TOKEN_LIFETIME = 12 * 60 * 60
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def _load(content_type, body):
+    if content_type.split(';')[0].strip() == _JSON:
+        return json.loads(body)
+    return yaml.load(body, Loader = _YAML_LOADER)
+
+
+def _dump(accept, data):
+    if _JSON in accept:
+        return _JSON, json.dumps(data)
+    return _YAML, yaml.dump(data, Dumper = _YAML_DUMPER)
+
+
+class FakeSaltAPI(object):
+    '''A fake Salt API server running in a background thread.
+
+    Interesting methods:
+        * start - starts serving,
+        * stop - stops serving,
+        * minion_started - emits a minion start event,
+        * minion_key_sent - makes a minion's key pending.
+
+    Interesting properties:
+        * url - the base URL of the server,
+        * requests - the number of requests handled so far,
+        * logins - the number of logins handled so far,
+        * chunks - lowstate chunks received so far.
+    '''
+
+    def __init__(
+            self,
+            minions = ('minion',),
+            latency = 0,
+            state_count = 10,
+            state_size = 100,
+            job_duration = 0,
+            token_lifetime = _TOKEN_LIFETIME,
+            gzip_min_size = 1024,
+            legacy_targeting = False,
+            host = '127.0.0.1',
+            port = 0):
+        '''Server constructor. -> FakeSaltAPI
+
+        Arguments:
+            * minions = identifiers of the minions which respond,
+            * latency = seconds added to every response,
+            * state_count = the number of states in a highstate result,
+            * state_size = the size of a single state's comment,
+            * job_duration = seconds after which an asynchronous job
+                    returns,
+            * token_lifetime = seconds a token is valid for,
+            * gzip_min_size = responses of at least this many bytes are
+                    gzip encoded, if the client accepts it (None never),
+            * legacy_targeting = if the target type is read from
+                    `expr_form' only, like masters older than 2017.7 do,
+            * host, port = the address to listen on (an ephemeral port
+                    by default).
+        '''
+        self.minions = list(minions)
+        self.latency = latency
+        self.state_count = state_count
+        self.state_size = state_size
+        self.job_duration = job_duration
+        self.token_lifetime = token_lifetime
+        self.gzip_min_size = gzip_min_size
+        self.legacy_targeting = legacy_targeting
+        self.requests = 0
+        self.logins = 0
+        self.chunks = []
+        self.pending_keys = []
+        self._tokens = {}
+        self._jobs = {}
+        self._events = []
+        self._events_cond = threading.Condition()
+        self._jids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._server = _Server((host, port), _Handler)
+        self._server.api = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self._server.server_address[:2])
+
+    def start(self):
+        self._thread = threading.Thread(target = self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._events_cond:
+            self._stopped = True
+            self._events_cond.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def minion_started(self, minion_id):
+        '''Emits the `salt/minion/<id>/start' event.'''
+        tag = 'salt/minion/{0}/start'.format(minion_id)
+        self._emit(tag, {'id': minion_id})
+
+    def minion_key_sent(self, minion_id):
+        '''Makes the minion's key pending, emitting `salt/auth'.'''
+        with self._lock:
+            if minion_id not in self.pending_keys:
+                self.pending_keys.append(minion_id)
+        self._emit('salt/auth', {'id': minion_id, 'act': 'pend'})
+
+    def _emit(self, tag, data):
+        with self._events_cond:
+            self._events.append((tag, data))
+            self._events_cond.notify_all()
+
+    def _count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    # Salt API operations.
+
+    def login(self, auth_data):
+        with self._lock:
+            self.logins += 1
+        now = time.time()
+        token = {
+                'token': uuid.uuid4().hex,
+                'start': now,
+                'expire': now + self.token_lifetime,
+                'user': auth_data.get('username', ''),
+                'eauth': auth_data.get('eauth', ''),
+                'perms': ['.*']
+            }
+        self._tokens[token['token']] = token
+        return {'return': [token]}
+
+    def logout(self, token):
+        self._tokens.pop(token, None)
+        return {'return': 'Your token has been cleared'}
+
+    def authorised(self, token):
+        token = self._tokens.get(token)
+        return token is not None and token['expire'] > time.time()
+
+    def _targets(self, chunk):
+        tgt = chunk.get('tgt', '')
+        tgt_type = chunk.get('expr_form')
+        if not self.legacy_targeting:
+            tgt_type = chunk.get('tgt_type', tgt_type)
+        if tgt_type == 'list':
+            if not isinstance(tgt, list):
+                tgt = tgt.split(',')
+            return [m for m in self.minions if m in tgt]
+        if not isinstance(tgt, basestring):
+            # A glob has to be a string.
+            return []
+        return [m for m in self.minions if fnmatch.fnmatch(m, tgt or '*')]
+
+    def _function_result(self, fun, arg):
+        if fun == 'test.ping':
+            return True
+        if fun == 'grains.ls':
+            return ['id', 'os', 'roles']
+        if fun in ('grains.append', 'grains.setval'):
+            return {arg[0]: arg[1]} if arg else {}
+        if fun == 'state.highstate':
+            return dict(
+                    ('file_|-state_{0}_|-/tmp/{0}_|-managed'.format(i), {
+                            'result': True,
+                            'changes': {},
+                            'comment': 'x' * self.state_size,
+                            '__run_num__': i
+                        })
+                    for i in xrange(self.state_count)
+                )
+        return None
+
+    def _wheel(self, chunk):
+        fun = chunk.get('fun')
+        if fun in ('key.list_all', 'key.list'):
+            with self._lock:
+                data = {'minions': list(self.minions),
+                        'minions_pre': list(self.pending_keys),
+                        'minions_rejected': [], 'minions_denied': []}
+        elif fun == 'key.accept':
+            match = chunk.get('match', [])
+            with self._lock:
+                accepted = [m for m in self.pending_keys
+                            if match == '*' or m == match or m in match]
+                for m in accepted:
+                    self.pending_keys.remove(m)
+                    self.minions.append(m)
+            data = {'minions': accepted} if accepted else {}
+        else:
+            data = {}
+        return {'tag': 'salt/wheel/0', 'data': {
+                'fun': 'wheel.' + fun, 'return': data, 'success': True}}
+
+    def _run_local(self, chunk):
+        return dict(
+                (m, self._function_result(chunk.get('fun'), chunk.get('arg')))
+                for m in self._targets(chunk))
+
+    def run(self, chunks):
+        with self._lock:
+            self.chunks.extend(chunks)
+        results = []
+        for chunk in chunks:
+            client = chunk.get('client', 'local')
+            if client == 'local_async':
+                jid = '{0:020d}'.format(next(self._jids))
+                minions = self._targets(chunk)
+                self._jobs[jid] = (time.time(), chunk, minions)
+                results.append({'jid': jid, 'minions': minions})
+            elif client == 'wheel':
+                results.append(self._wheel(chunk))
+            elif client == 'local_batch':
+                # rest_cherrypy flattens the batch generator: every
+                # minion's return is a separate entry.
+                results.extend(
+                        {m: r} for m, r in
+                        sorted(self._run_local(chunk).iteritems()))
+            else:
+                results.append(self._run_local(chunk))
+        return {'return': results}
+
+    def job(self, jid):
+        if jid not in self._jobs:
+            return {'info': [{}], 'return': [{}]}
+        submitted, chunk, minions = self._jobs[jid]
+        info = {'jid': jid, 'Function': chunk.get('fun'), 'Minions': minions}
+        if time.time() - submitted < self.job_duration:
+            return {'info': [info], 'return': [{}]}
+        return {'info': [info], 'return': [self._run_local(chunk)]}
+
+    def iter_events(self, timeout):
+        deadline = time.time() + timeout
+        seen = len(self._events)
+        while time.time() < deadline and not self._stopped:
+            with self._events_cond:
+                if seen == len(self._events) and not self._stopped:
+                    self._events_cond.wait(deadline - time.time())
+                pending = self._events[seen:]
+                seen = len(self._events)
+            for tag, data in pending:
+                yield tag, data
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    _EVENT_STREAM_LIFETIME = 60
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, data = None):
+        api = self.server.api
+        if api.latency:
+            time.sleep(api.latency)
+        content_type, body = _dump(self.headers.get('Accept', _YAML), data)
+        self.send_response(status)
+        if (api.gzip_min_size is not None
+                and len(body) >= api.gzip_min_size
+                and 'gzip' in self.headers.get('Accept-Encoding', '')):
+            compressor = zlib.compressobj(
+                    zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, _GZIP_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, _GZIP_WBITS)
+        return _load(self.headers.get('Content-Type', _YAML), body)
+
+    def _authorised(self):
+        return self.server.api.authorised(self.headers.get('X-Auth-Token'))
+
+    def do_POST(self):
+        api = self.server.api
+        api._count_request()
+        data = self._read_body()
+        if self.path == '/login':
+            self._reply(200, api.login(data or {}))
+        elif self.path == '/logout':
+            self._reply(200, api.logout(self.headers.get('X-Auth-Token')))
+        elif self.path in ('', '/'):
+            if not self._authorised():
+                self._reply(401, {'return': 'Please log in'})
+            else:
+                self._reply(200, api.run(data))
+        else:
+            self._reply(404, {'return': 'Not found'})
+
+    def do_GET(self):
+        api = self.server.api
+        api._count_request()
+        if not self._authorised():
+            self._reply(401, {'return': 'Please log in'})
+        elif self.path.startswith('/jobs/'):
+            self._reply(200, api.job(self.path[len('/jobs/'):]))
+        elif self.path == '/events':
+            self._stream_events()
+        else:
+            self._reply(404, {'return': 'Not found'})
+
+    def _stream_events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = 1
+        self.wfile.write('retry: 400\n\n')
+        self.wfile.flush()
+        api = self.server.api
+        for tag, data in api.iter_events(self._EVENT_STREAM_LIFETIME):
+            event = json.dumps({'tag': tag, 'data': data})
+            self.wfile.write('tag: {0}\ndata: {1}\n\n'.format(tag, event))
+            self.wfile.flush()
@@ -0,0 +1,116 @@
+###############################################################################
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+
+'''Tests of `AsyncSaltRESTManager' against the fake Salt API.
+
+Run with `python -m unittest discover tests' from the repository root.
+'''
+
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from main import saltapimgr
+
+import fake_salt_api
+
+
+_AUTH_DATA = {'eauth': 'pam', 'username': 'test', 'password': 'test'}
+_MINIONS = ['minion_1', 'minion_2']
+_TIMEOUT = 10
+
+
+class AsyncSaltRESTManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = fake_salt_api.FakeSaltAPI(
+                minions = list(_MINIONS),
+                state_count = 3
+            ).start()
+        self.mgr = saltapimgr.AsyncSaltRESTManager(
+                self.api.url,
+                connection_limit = 4,
+                auth_data = _AUTH_DATA
+            )
+        response, result = self.mgr.log_in().get(_TIMEOUT)
+        self.assertTrue(response.ok)
+
+    def tearDown(self):
+        self.mgr.close()
+        self.api.stop()
+
+    def test_log_in(self):
+        self.assertTrue(self.mgr.manager.token)
+
+    def test_call(self):
+        response, result = self.mgr.call(
+                {'tgt': 'minion_1', 'fun': 'test.ping'}).get(_TIMEOUT)
+        self.assertTrue(response.ok)
+        self.assertEqual(result, {'minion_1': True})
+
+    def test_ping(self):
+        response, result = self.mgr.ping('*').get(_TIMEOUT)
+        self.assertTrue(response.ok)
+        self.assertEqual(result, dict((m, True) for m in _MINIONS))
+
+    def test_highstate(self):
+        response, result = self.mgr.highstate('minion_1').get(_TIMEOUT)
+        self.assertTrue(response.ok)
+        self.assertEqual(len(result['minion_1']), 3)
+        self.assertTrue(all(
+                state['result'] for state in result['minion_1'].itervalues()))
+
+    def test_append_grain(self):
+        response, result = self.mgr.append_grain(
+                'minion_1', 'roles', 'web').get(_TIMEOUT)
+        self.assertTrue(response.ok)
+        self.assertEqual(result, {'minion_1': {'roles': 'web'}})
+
+    def test_list_grains(self):
+        response, result = self.mgr.list_grains('minion_2').get(_TIMEOUT)
+        self.assertTrue(response.ok)
+        self.assertEqual(result, {'minion_2': ['id', 'os', 'roles']})
+
+    def test_log_out(self):
+        response, result = self.mgr.log_out().get(_TIMEOUT)
+        self.assertTrue(response.ok)
+        self.assertIsNone(self.mgr.manager.token)
+
+    def test_callback(self):
+        called = threading.Event()
+        results = []
+
+        def callback(value):
+            results.append(value[1])
+            called.set()
+
+        self.mgr.ping('minion_2', callback = callback)
+        self.assertTrue(called.wait(_TIMEOUT))
+        self.assertEqual(results, [{'minion_2': True}])
+
+    def test_concurrent_calls(self):
+        pending = [self.mgr.ping('minion_1') for _ in xrange(20)]
+        for call in pending:
+            response, result = call.get(_TIMEOUT)
+            self.assertEqual(result, {'minion_1': True})
+
+
+if __name__ == '__main__':
+    unittest.main()
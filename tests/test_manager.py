@@ -0,0 +1,177 @@
+###############################################################################
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+
+'''Tests of `SaltRESTManager' against the fake Salt API.
+
+Run with `python -m unittest discover tests' from the repository root.
+'''
+
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from main import saltapimgr
+
+import fake_salt_api
+
+
+_AUTH_DATA = {'eauth': 'pam', 'username': 'test', 'password': 'test'}
+_MINIONS = ['minion_1', 'minion_2', 'minion_3', 'minion_4']
+_TIMEOUT = 10
+
+
+def _run_threads(target, args):
+    # Runs `target' with each of `args' in a thread of its own, all
+    # starting at once. -> the list of results
+    start = threading.Event()
+    results = [None] * len(args)
+
+    def run(i):
+        start.wait(_TIMEOUT)
+        results[i] = target(args[i])
+
+    threads = [
+            threading.Thread(target = run, args = (i,))
+            for i in xrange(len(args))
+        ]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join(_TIMEOUT)
+    return results
+
+
+class FailOverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.apis = [
+                fake_salt_api.FakeSaltAPI(minions = list(_MINIONS)).start()
+                for _ in xrange(2)
+            ]
+        self.mgr = saltapimgr.SaltRESTManager(
+                [api.url for api in self.apis],
+                auth_data = _AUTH_DATA,
+                keep_alive = False
+            )
+
+    def tearDown(self):
+        for api in self.apis:
+            if api is not None:
+                api.stop()
+
+    def test_ping_after_issuer_stops(self):
+        self.mgr.log_in()
+        issuer = [api.logins for api in self.apis].index(1)
+        other = self.apis[1 - issuer]
+        token = self.mgr.token
+        self.apis[issuer].stop()
+        self.apis[issuer] = None
+        response, result = self.mgr.ping('minion_1')
+        self.assertTrue(response.ok)
+        self.assertEqual(result, {'minion_1': True})
+        self.assertEqual(other.logins, 1)
+        self.assertNotEqual(self.mgr.token['token'], token['token'])
+        response, result = self.mgr.ping('minion_2')
+        self.assertEqual(result, {'minion_2': True})
+        self.assertEqual(other.logins, 1)
+
+
+class CoalescedTargetingTest(unittest.TestCase):
+
+    def setUp(self):
+        # A master reading the target type from `expr_form' only.
+        self.api = fake_salt_api.FakeSaltAPI(
+                minions = list(_MINIONS),
+                latency = 0.2,
+                legacy_targeting = True
+            ).start()
+        self.mgr = saltapimgr.SaltRESTManager(
+                self.api.url,
+                auth_data = _AUTH_DATA,
+                coalescer = saltapimgr.coalesce.Coalescer(1),
+                thread_safe = True
+            )
+        self.mgr.log_in()
+
+    def tearDown(self):
+        self.mgr.close()
+        self.api.stop()
+
+    def test_lone_call(self):
+        response, result = self.mgr.ping('minion_1')
+        self.assertEqual(result, {'minion_1': True})
+        chunk, = self.api.chunks
+        self.assertEqual(chunk['tgt'], 'minion_1')
+        self.assertNotIn('tgt_type', chunk)
+        self.assertNotIn('expr_form', chunk)
+
+    def test_merged_calls(self):
+        # The first call is sent at once, the others wait for it
+        # in a single batch.
+        first = threading.Thread(target = self.mgr.ping, args = ('minion_1',))
+        first.start()
+        time.sleep(0.05)
+        results = _run_threads(self.mgr.ping, _MINIONS[1:])
+        first.join(_TIMEOUT)
+        self.assertEqual(
+                [result for _, result in results],
+                [{minion: True} for minion in _MINIONS[1:]]
+            )
+        merged = [c for c in self.api.chunks if isinstance(c['tgt'], list)]
+        self.assertEqual(len(merged), 1)
+        self.assertEqual(sorted(merged[0]['tgt']), _MINIONS[1:])
+        self.assertEqual(merged[0]['expr_form'], 'list')
+        self.assertEqual(merged[0]['tgt_type'], 'list')
+
+
+class TokenCacheContentionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = fake_salt_api.FakeSaltAPI().start()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'tokens.yaml')
+
+    def tearDown(self):
+        self.api.stop()
+        shutil.rmtree(self.directory)
+
+    def test_single_login(self):
+        def log_in(_):
+            # A cache of its own, like in another process.
+            mgr = saltapimgr.SaltRESTManager(
+                    self.api.url,
+                    auth_data = _AUTH_DATA,
+                    token_cache = saltapimgr.TokenCache(self.path)
+                )
+            mgr.log_in()
+            return mgr.token['token']
+
+        tokens = _run_threads(log_in, range(8))
+        self.assertEqual(self.api.logins, 1)
+        self.assertEqual(len(set(tokens)), 1)
+        self.assertIsNotNone(tokens[0])
+
+
+if __name__ == '__main__':
+    unittest.main()